@@ -0,0 +1,371 @@
+#!/usr/bin/python3
+
+""" Benchmarks europarl-to-ecpc-xml.py on a generated corpus, stage by stage:
+
+    read     reading the session files of the source language
+    parse    tokenizing SPEAKER headers and parsing names, affiliations and languages
+    clean    cleaning the speech lines (add_data) and finalizing interventions
+    resolve  resolving UNKNOWN languages against the other language directories
+    write    writing the ecpc_EP xml files
+    convert  all of the above through convert_file(), as a run of the converter does
+
+    e.g.
+    ./europarl-benchmark.py --sessions 50 --save baseline.json
+    (change something)
+    ./europarl-benchmark.py --sessions 50 --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import europarl_to_ecpc_xml as europarl
+
+
+first_names = ['Robert J', 'Klaus', 'Hans-Peter', 'Marie-Noëlle', 'José Ignacio', 'Anna', 'Jan', 'Elizabeth',
+               'Paolo', 'Róża', 'Bogdan', 'Inés', 'Søren Bo', 'Glenys', 'Jean-Claude', 'Olle']
+last_names = ['Evans', 'Hänsch', 'Martin', 'Lienemann', 'Salafranca Sánchez-Neyra', 'Záborská', 'Andersson',
+              'Lynne', 'Costa', 'Thun und Hohenstein', 'Klich', 'Ayuso', 'Søndergaard', 'Kinnock', 'Juncker',
+              'Schmidt', 'De Rossa', 'van den Berg']
+# the spellings of the groups that process_affiliation() corrects, as well as the correct ones
+affiliation_aliases = ['PPE-DE', 'PPE–DE', 'PPE', 'PSE', 'PSSE', 'ALDE', 'ALDE-DE', 'Verts/ALE', 'GUE/NGL',
+                       'UEN', 'IND/DEM', 'NI', 'ELDR', 'EDD', 'ARE', 'I-EDN', 'UPE', 'TDI', 'S&amp;D', 'S-D',
+                       'ECR', 'EFD', 'EPP-ED', 'PES', 'G/EFA']
+conjunctions = [' and ', ' & ', ' et ']
+sentences = ['Madam President, on a point of order.',
+             'You will be aware from the press and television that there have been a number of bomb explosions.',
+             'I would like to thank the rapporteur [amp] the shadow rapporteurs for their work [...]',
+             'The Commission has taken note of the amendments ... and will examine them carefully.',
+             'We must ensure that the citizens of Europe are not left behind… (Applause)',
+             'As stated in [Article 143/2] of the Rules of Procedure, the vote will take place tomorrow.',
+             'That is why my group cannot support this proposal () [] [?] in its current form.',
+             '(Parliament adopted the resolution) <P>',
+             'Mr President, ladies and gentlemen, the situation in the region remains very worrying.',
+             'I should like to ask the Council whether it intends to act on this matter before the summer.']
+session_headings = ['Resumption of the session', 'Approval of the minutes of the previous sitting',
+                    'Order of business', 'Question Time (Commission)', 'Explanations of vote', 'Votes']
+
+
+def make_name(rng):
+    return f'{rng.choice(first_names)} {rng.choice(last_names)}'
+
+
+def make_speaker(rng, speech_id, id_quoted, affiliation):
+    """ A SPEAKER's ID, NAME and AFFILIATION attributes, in one of the forms
+        found in the corpus
+    """
+    speaker_id = f'ID="{speech_id}"' if id_quoted else f'ID={speech_id}'
+    variant = rng.randrange(8)
+    if variant == 0:
+        return f'{speaker_id} NAME="President"'
+    if variant == 1:
+        return f'{speaker_id} NAME="{rng.choice(last_names)}, {rng.choice(first_names)}"'
+    if variant == 2:
+        return f'{speaker_id} NAME="{make_name(rng)} ({affiliation})"'
+    if variant == 3:
+        return f'{speaker_id} NAME="{make_name(rng)}" AFFILIATION="on behalf of the {affiliation} Group"'
+    if variant == 4:
+        return f'{speaker_id} NAME="{make_name(rng)}{rng.choice(conjunctions)}{make_name(rng)}"'
+    if variant == 5:
+        names = [make_name(rng) for n in range(rng.randint(3, 6))]
+        return f'{speaker_id} NAME="{", ".join(names[:-1])}{rng.choice(conjunctions)}{names[-1]} ({affiliation})"'
+    if variant == 6:
+        return f'{speaker_id} NAME="{rng.choice(last_names)} ({affiliation})." AFFILIATION="({affiliation})"'
+    return f'{speaker_id} NAME="{make_name(rng)}, {make_name(rng)} ({affiliation})"'
+
+
+def make_session(rng, speeches, paragraphs):
+    """ The speeches of a session, shared by all of its language versions """
+    session = []
+    for speech_id in range(1, speeches + 1):
+        chapter = speech_id == 1 or rng.random() < 0.1
+        session.append({'chapter': chapter,
+                        'speaker': make_speaker(rng, speech_id, rng.random() < 0.5, rng.choice(affiliation_aliases)),
+                        'language': rng.choice(europarl.valid_langs),
+                        'paragraphs': [' '.join(rng.choices(sentences, k=rng.randint(1, 4)))
+                                       for n in range(rng.randint(1, paragraphs))]})
+    return session
+
+
+def render_session(rng, session, labelled):
+    """ One language version of a session. Only some of the speeches are
+        labelled with their LANGUAGE, either as an attribute or in brackets at
+        the start of the speech, so that the others are UNKNOWN until they
+        are found in another language version
+    """
+    lines = []
+    chapter_id = 0
+    for speech in session:
+        if speech['chapter']:
+            chapter_id += 1
+            lines.append(f'<CHAPTER ID={chapter_id}>')
+            lines.append(rng.choice(session_headings))
+        speaker = speech['speaker']
+        language = speech['language']
+        paragraphs = list(speech['paragraphs'])
+        label = rng.random()
+        if label < labelled * 0.8:
+            speaker += f' LANGUAGE="{language}"'
+        elif label < labelled:
+            paragraphs[0] = f'({language}) {paragraphs[0]}'
+        lines.append(f'<SPEAKER {speaker}>')
+        for n, paragraph in enumerate(paragraphs):
+            if n:
+                lines.append('<P>')
+            lines.append(paragraph)
+    return '\n'.join(lines) + '\n'
+
+
+def get_langs(language, languages):
+    """ The language to convert, then as many others as needed """
+    others = [lang.lower() for lang in europarl.valid_langs if lang.lower() != language]
+    return ([language] + others)[:languages]
+
+
+def generate_corpus(path, sessions, langs, speeches, paragraphs, labelled, seed):
+    """ Writes <path>/<lang>/ep-YY-MM-DD.txt for each session and language """
+    rng = random.Random(seed)
+    for lang in langs:
+        os.makedirs(os.path.join(path, lang), exist_ok=True)
+    for n in range(sessions):
+        filename = f'ep-{n // 336 % 100:02}-{n // 28 % 12 + 1:02}-{n % 28 + 1:02}.txt'
+        session = make_session(rng, speeches, paragraphs)
+        for lang in langs:
+            with open(os.path.join(path, lang, filename), 'w', encoding='utf-8') as ofile:
+                ofile.write(render_session(rng, session, labelled))
+
+
+class Benchmark():
+    """ Runs the conversion of one language of a corpus a stage at a time.
+        Each stage uses what the previous stage produced.
+    """
+
+    stages = ['read', 'parse', 'clean', 'resolve', 'write', 'convert']
+
+    def __init__(self, input_path, lang, output_path):
+        self.corpus = europarl.open_corpus(input_path)
+        self.lang = lang
+        self.output_path = output_path
+        self.files = {}
+        self.interventions = {}
+
+    def reset(self):
+        """ Starts from cold caches, as a new run of the converter does """
+        europarl.speaker_registry = europarl.SpeakerRegistry()
+        europarl.Speaker.correct_name.cache_clear()
+        europarl.Intervention.process_affiliation.cache_clear()
+        self.corpus.sessions = {}
+
+    def run_read(self):
+        self.files = {}
+        size = 0
+        for filename in self.corpus.list_files(self.lang):
+            self.files[filename] = list(self.corpus.read_lines(self.lang, filename))
+            size += sum(len(line) for line in self.files[filename])
+        return sum(len(lines) for lines in self.files.values()), size
+
+    def run_parse(self):
+        self.interventions = {}
+        count = 0
+        size = 0
+        for filename, lines in self.files.items():
+            interventions = self.interventions[filename] = []
+            for line in lines:
+                if line.startswith('<SPEAKER'):
+                    interventions.append((europarl.Intervention(line), []))
+                    count += 1
+                    size += len(line)
+                elif interventions and not line.startswith('<CHAPTER'):
+                    interventions[-1][1].append(line)
+        return count, size
+
+    def run_clean(self):
+        count = 0
+        size = 0
+        for interventions in self.interventions.values():
+            for i, lines in interventions:
+                for line in lines:
+                    i.add_data(line)
+                    size += len(line)
+                count += len(lines)
+                i.finalize()
+        return count, size
+
+    def run_resolve(self):
+        language_index = europarl.LanguageIndex(self.corpus)
+        count = 0
+        for filename, interventions in self.interventions.items():
+            for i, lines in interventions:
+                if i.language == 'UNKNOWN':
+                    i.language = language_index.lookup(filename, i.speech_id, exclude=self.lang) or 'UNKNOWN'
+                    count += 1
+        return count, 0
+
+    def run_write(self):
+        output_path = os.path.join(self.output_path, 'write')
+        os.makedirs(output_path, exist_ok=True)
+        count = 0
+        size = 0
+        for filename, interventions in self.interventions.items():
+            output_filename = os.path.join(output_path, europarl.get_output_filename(self.lang, filename))
+            with europarl.EcpcWriter(output_filename, os.path.basename(output_filename), self.lang.upper()) as writer:
+                for i, lines in interventions:
+                    writer.write_intervention(i)
+            count += len(interventions)
+            size += os.path.getsize(output_filename)
+        return count, size
+
+    def run_convert(self):
+        self.reset()
+        language_index = europarl.LanguageIndex(self.corpus)
+        cwd = os.getcwd()
+        os.chdir(self.output_path)
+        try:
+            count = 0
+            for filename in self.files:
+                europarl.convert_file(self.corpus, self.lang, filename, language_index)
+                count += 1
+        finally:
+            os.chdir(cwd)
+        return count, sum(sum(len(line) for line in lines) for lines in self.files.values())
+
+    def run(self, trace_memory=False):
+        """ Returns {stage: {'seconds', 'items', 'bytes', 'peak_memory'}} """
+        self.reset()
+        results = {}
+        for stage in self.stages:
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            items, size = getattr(self, f'run_{stage}')()
+            seconds = time.perf_counter() - start
+            result = {'seconds': seconds, 'items': items, 'bytes': size}
+            if trace_memory:
+                result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            results[stage] = result
+        return results
+
+
+def run_benchmark(args, input_path, output_path):
+    # relative output paths used by convert_file() are created under output_path
+    os.makedirs(os.path.join(output_path, 'xml', args.language), exist_ok=True)
+    benchmark = Benchmark(os.path.abspath(input_path), args.language, output_path)
+    stages = {}
+    for n in range(args.repeat):
+        for stage, result in benchmark.run().items():
+            # the fastest repeat is the least disturbed by the rest of the system
+            if stage not in stages or result['seconds'] < stages[stage]['seconds']:
+                stages[stage] = result
+    if not args.no_memory:
+        # tracing slows everything down, so memory is measured in a separate pass
+        for stage, result in benchmark.run(trace_memory=True).items():
+            stages[stage]['peak_memory'] = result['peak_memory']
+    return stages
+
+
+def format_rate(count, seconds, unit=''):
+    if not count:
+        return '-'
+    rate = count / seconds if seconds else float('inf')
+    for prefix in ['', 'k', 'M', 'G']:
+        if rate < 1000:
+            break
+        rate /= 1000
+    return f'{rate:.1f}{prefix}{unit}/s'
+
+
+def print_results(stages):
+    print(f'{"stage":<10}{"seconds":>10}{"items":>10}{"items/s":>14}{"bytes/s":>14}{"peak memory":>14}')
+    for stage, result in stages.items():
+        peak_memory = result.get('peak_memory')
+        peak_memory = f'{peak_memory / 1e6:.1f}MB' if peak_memory is not None else '-'
+        print(f'{stage:<10}{result["seconds"]:>10.3f}{result["items"]:>10}'
+              f'{format_rate(result["items"], result["seconds"]):>14}'
+              f'{format_rate(result["bytes"], result["seconds"], "B"):>14}{peak_memory:>14}')
+
+
+def compare_results(baseline, results, tolerance):
+    """ Returns the stages that were slower, or used more memory, than the
+        baseline by more than the tolerance
+    """
+    if baseline['params'] != results['params']:
+        print(f'Warning: the baseline was run with {baseline["params"]}')
+    regressions = []
+    print(f'{"stage":<10}{"baseline":>10}{"now":>10}{"change":>10}{"memory":>10}')
+    for stage, result in results['stages'].items():
+        old = baseline['stages'].get(stage)
+        if not old:
+            continue
+        change = result['seconds'] / old['seconds'] - 1 if old['seconds'] else 0
+        memory_change = None
+        if result.get('peak_memory') and old.get('peak_memory'):
+            memory_change = result['peak_memory'] / old['peak_memory'] - 1
+        flag = ''
+        if change > tolerance or (memory_change is not None and memory_change > tolerance):
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        memory = f'{memory_change:+.1%}' if memory_change is not None else '-'
+        print(f'{stage:<10}{old["seconds"]:>10.3f}{result["seconds"]:>10.3f}{change:>+10.1%}{memory:>10}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark europarl-to-ecpc-xml.py on a generated corpus')
+    parser.add_argument('--sessions', type=int, default=20, help='Number of session files per language')
+    parser.add_argument('--languages', type=int, default=5, help='Number of language directories (at most 23)')
+    parser.add_argument('--speeches', type=int, default=100, help='Number of speeches per session')
+    parser.add_argument('--paragraphs', type=int, default=5, help='Maximum number of paragraphs per speech')
+    parser.add_argument('--labelled', type=float, default=0.6,
+                        help='Fraction of speeches whose language is given in each language version')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated corpus')
+    parser.add_argument('--language', default='en', type=str.lower, help='Language directory to convert')
+    parser.add_argument('--input', help='Benchmark this txt directory or archive instead of generating a corpus')
+    parser.add_argument('--keep', help='Generate the corpus in this directory and keep it')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, the fastest is reported')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory pass')
+    parser.add_argument('--save', help='json file to save the results to, as a baseline')
+    parser.add_argument('--compare', help='json baseline to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Fraction by which a stage may be slower than the baseline (default 0.1)')
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ['sessions', 'languages', 'speeches', 'paragraphs',
+                                                  'labelled', 'seed', 'language', 'input']}
+    work_path = tempfile.mkdtemp(prefix='europarl-benchmark-')
+    try:
+        input_path = args.input
+        if not input_path:
+            input_path = args.keep or os.path.join(work_path, 'txt')
+            start = time.perf_counter()
+            generate_corpus(input_path, args.sessions, get_langs(args.language, args.languages), args.speeches,
+                            args.paragraphs, args.labelled, args.seed)
+            print(f'Generated {args.sessions} sessions in {args.languages} languages in {input_path} '
+                  f'({time.perf_counter() - start:.1f}s)')
+        stages = run_benchmark(args, input_path, work_path)
+    finally:
+        shutil.rmtree(work_path)
+
+    print_results(stages)
+    results = {'params': params, 'python': sys.version.split()[0], 'stages': stages}
+    if args.save:
+        with open(args.save, 'w') as ofile:
+            json.dump(results, ofile, indent=2)
+        print(f'Saved results to {args.save}')
+    if args.compare:
+        with open(args.compare) as ifile:
+            baseline = json.load(ifile)
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print(f'Slower than the baseline: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
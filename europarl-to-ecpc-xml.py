@@ -1,26 +1,106 @@
 #!/usr/bin/python3
 
-import argparse
+# modules that are only needed by some options are imported where they are used,
+# so that importing this module, or converting a few files, starts quickly
+import collections
+import functools
+import io
+import json
+import logging
 import mmap
 import os
 import re
 import sys
-from pathlib import Path
-from pprint import pformat
+import time
 
 
-all_speakers = set()
+log = logging.getLogger('europarl')
+index_log = logging.getLogger('europarl.index')
+speaker_log = logging.getLogger('europarl.speaker')
+names_log = logging.getLogger('europarl.names')
+affiliation_log = logging.getLogger('europarl.affiliation')
+language_log = logging.getLogger('europarl.language')
+log_categories = ['index', 'speaker', 'names', 'affiliation', 'language']
+
+default_dtd = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ep.dtd')
+# --watch leaves files modified more recently than this for the next poll
+watch_settle_seconds = 1
+
 
 valid_langs = ['BG', 'CS', 'DA', 'DE', 'EL', 'EN', 'ES', 'ET', 'FI', 'FR',
                'GA', 'HU', 'IT', 'LT', 'LV', 'MT', 'NL', 'PL', 'PT', 'RO',
                'SK', 'SL', 'SV']
 
+whitespace_regex = re.compile(r'\s+')
+spaces_regex = re.compile(r' +')
+article_regex = re.compile(r'\[Article[^\]*]\]')
+bracketed_slash_regex = re.compile(r'\[[^\]]*\/[^\]]*\]')
+
+english_phrases = [
+    r'\(?Parliament adopted the resolution\)?',
+    r'\(?Parliament adopted the Commission proposal\)?',
+    r'\(?Parliament adopted the legislative resolution\)?',
+    r'\(?Parliament gave its assent\)?',
+    r'\(?Parliament rejected the motion for a resolution\)?',
+    r'\(?Parliament rejected the[^\)]*\)?',
+    r'\((?:The )?Parliament[^\)]*\)',
+    r'\(The [Hh]ouse[^\)]*\)',
+    r'\(*The Minutes were approved\)*',
+    r'\(* *Approval of the [Mm]inutes(?: of the previous sitting[s]?)? *\)*',
+    r'\(Explanation[s]? of (?:the )?vote[^\)]*\)',
+    r'\(For (?:the )?results [^\)]*\)',
+    r'\(For the outcome [^\)]*\)',
+    r'\(The explanation[^\)]*\)',
+    r'\(The Member[^\)]*\)',
+    r'\(Members[^\)]*\)',
+    r'\(The meeting was[^\)]*\)',
+    r'\(The oral amendment was[^\)]*\)',
+    r'\(The order of business[^\)]*\)',
+    r'\([Tt]he (?:formal )?sitting [^\)]*\)',
+    r'\([Tt]he speaker [^\)]*\)',
+    r'\([Tt]he request [^\)]*\)',
+    r'\([Tt]he report [^\)]*\)',
+    r'\([Tt]he session was [^\)]*\)',
+    r'\(The Commissioner [^\)]\)',
+    r'\(The President [^\)]\)',
+    r'\(The Assembly [^\)]\)',
+    r'\(The amendment [^\)]\)',
+    r'\(Text [^\)]\)',
+    r'\(Abbreviated [^\)]\)',
+    r'\(adopted [^\)]\)',
+    r'\(During successive [^\)]\)',
+    r'\([Tt]he proposal[^)]*\)',
+    r'\(The vote [^)]*\)',
+    r'\(Intervention cut short pursuant to[^\)]*\)',
+    r'\(In successive votes[^)]*\)',
+    r'\(Mixed react[^)]*\)',
+    r'\(Laughter and applause\)',
+    r'\(Laughter\)',
+    r'Statement by'
+    r'\(*Vigorous applause\)*',
+    r'\(*Loud applause\)*',
+    r'\([^\)]*[Aa]pplause[^\)]*\)',
+    r'\([^\)]*[Ll]aughter[^\)]*\)',
+    r'\([^\)]*[Hh]eckling[^\)]*\)',
+    r'\(*Murmurs of dissent\)*',
+    r'\(Exclamations\)',
+    r'\(Muted applause\)',
+    r'\(*Adjournment of the session\)*',
+    r'Report \([^\)]\/[^\)]*\)',
+    r'Draft Amendment No',
+]
+english_phrases_regex = re.compile(f'({"|".join(english_phrases)})')
+
+
+def slots_dict(o):
+    return {slot: getattr(o, slot, None) for slot in o.__slots__}
+
 
 class Document():
 
-    def __init__(self, original_filename, language, use_new_filename=False, interventions=[]):
+    def __init__(self, original_filename, language, use_new_filename=False, interventions=None):
         self.original_filename = original_filename
-        self.interventions = interventions
+        self.interventions = interventions if interventions is not None else []
         self.language = ''
         if use_new_filename:
             self.modify_filename()
@@ -32,6 +112,11 @@ class Document():
 
 
 class Speaker():
+    """ Speakers are equal if their name and affiliation are, which are only
+        final once the Intervention they belong to has been finalized
+    """
+
+    __slots__ = ('name', 'affiliation', 'possible_affiliation')
 
     def __init__(self, name, affiliation=None, possible_affiliation=None):
         self.name = self.correct_name(name)
@@ -39,9 +124,22 @@ class Speaker():
         self.possible_affiliation = possible_affiliation
 
     def __repr__(self):
-        return pformat(dict(vars(self)), width=150)
+        from pprint import pformat
+        return pformat(slots_dict(self), width=150)
+
+    def __eq__(self, other):
+        if not isinstance(other, Speaker):
+            return NotImplemented
+        return self.get_key() == other.get_key()
+
+    def __hash__(self):
+        return hash(self.get_key())
+
+    def get_key(self):
+        return self.name, self.affiliation
 
     @staticmethod
+    @functools.lru_cache(maxsize=65536)
     def correct_name(s):
         n = s
         n = n.lstrip().rstrip(' ,,-')
@@ -71,20 +169,341 @@ class Speaker():
         return n
 
 
+class SpeakerRegistry():
+    """ Holds one canonical Speaker per (name, affiliation), so that the
+        thousands of MEPs that recur throughout the corpus are only held in
+        memory once, and counts how often each one speaks. Only pool workers
+        track_new counts, for the parent to take.
+    """
+
+    def __init__(self, track_new=False):
+        self.speakers = {}
+        self.counts = {}
+        self.new_counts = {}
+        self.track_new = track_new
+
+    def intern(self, speaker):
+        key = speaker.get_key()
+        canonical = self.speakers.setdefault(key, speaker)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.track_new:
+            self.new_counts[key] = self.new_counts.get(key, 0) + 1
+        return canonical
+
+    def take_new(self):
+        """ Returns the counts since the last call, so that pool workers can
+            hand them back to the parent
+        """
+        new_counts = self.new_counts
+        self.new_counts = {}
+        return new_counts
+
+    def update(self, counts):
+        for key, count in counts.items():
+            key = tuple(key)
+            if key not in self.speakers:
+                speaker = Speaker.__new__(Speaker)
+                speaker.name, speaker.affiliation = key
+                speaker.possible_affiliation = None
+                self.speakers[key] = speaker
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def export(self, filename):
+        import csv
+        with open(filename, 'w', newline='') as ofile:
+            writer = csv.writer(ofile)
+            writer.writerow(['name', 'affiliation', 'interventions'])
+            for key in sorted(self.speakers):
+                writer.writerow([*key, self.counts[key]])
+        log.info('Wrote %s speakers to %s', len(self.speakers), filename)
+
+
+speaker_registry = SpeakerRegistry()
+
+
+class RunStats():
+    """ Cumulative time spent in each stage of the conversion, and counters of
+        how often each parsing heuristic fired. Pool workers hand theirs back
+        with take(), to be added to the parent's with update().
+        Single SPEAKER headers or speeches that take longer than
+        slow_input_seconds of CPU time to parse or clean are kept as slow
+        inputs, as they are likely to be backtracking in one of the regexes
+        (CPU time, so that a busy machine does not make ordinary inputs look
+        slow). With --profile the slowest files are kept along with their top
+        functions.
+    """
+
+    # convert is the whole of each file's conversion, including reading it
+    stages = ['convert', 'parse', 'clean', 'resolve', 'write', 'validate', 'dataset']
+    cached_functions = {'correct_name': lambda: Speaker.correct_name,
+                        'process_affiliation': lambda: Intervention.process_affiliation}
+    slow_input_seconds = 0.01
+    max_slow_inputs = 20
+
+    def __init__(self, profile_top=10):
+        self.timers = collections.Counter()
+        self.counters = collections.Counter()
+        self.cache_info = {}
+        self.profile_top = profile_top
+        self.profiles = []
+        self.slow_inputs = []
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_time(self, stage, seconds):
+        self.timers[stage] += seconds
+
+    def collect_caches(self):
+        """ Adds the hits and misses of the lru caches since the last call """
+        for name, get_function in self.cached_functions.items():
+            info = get_function().cache_info()
+            hits, misses = self.cache_info.get(name, (0, 0))
+            self.counters[f'cache.{name}.hits'] += info.hits - hits
+            self.counters[f'cache.{name}.misses'] += info.misses - misses
+            self.cache_info[name] = (info.hits, info.misses)
+
+    def check_input(self, stage, filename, text, cpu_seconds):
+        if cpu_seconds < self.slow_input_seconds:
+            return
+        self.count('slow_inputs')
+        self.add_slow_inputs([{'stage': stage, 'file': filename, 'cpu_seconds': cpu_seconds, 'length': len(text),
+                               'text': text[:200]}])
+
+    def add_slow_inputs(self, slow_inputs):
+        self.slow_inputs = sorted(self.slow_inputs + slow_inputs, key=lambda i: i['cpu_seconds'],
+                                  reverse=True)[:self.max_slow_inputs]
+
+    def add_profiles(self, profiles):
+        self.profiles = sorted(self.profiles + profiles, key=lambda p: p['seconds'],
+                               reverse=True)[:self.profile_top]
+
+    def take(self):
+        self.collect_caches()
+        taken = (dict(self.timers), dict(self.counters), self.profiles, self.slow_inputs)
+        self.timers.clear()
+        self.counters.clear()
+        self.profiles = []
+        self.slow_inputs = []
+        return taken
+
+    def update(self, taken):
+        timers, counters, profiles, slow_inputs = taken
+        self.timers.update(timers)
+        self.counters.update(counters)
+        self.add_profiles(profiles)
+        self.add_slow_inputs(slow_inputs)
+
+    def get_hit_rates(self):
+        rates = {}
+        for name in list(self.cached_functions) + ['language_index']:
+            hits = self.counters[f'cache.{name}.hits']
+            total = hits + self.counters[f'cache.{name}.misses']
+            if total:
+                rates[name] = hits / total
+        return rates
+
+    def to_dict(self, elapsed):
+        self.collect_caches()
+        rates = {}
+        for name in ['files', 'interventions', 'bytes']:
+            rates[f'{name}_per_second'] = self.counters[name] / elapsed if elapsed else 0
+        return {'elapsed': elapsed, 'stages': dict(self.timers), 'rates': rates,
+                'cache_hit_rates': self.get_hit_rates(), 'counters': dict(sorted(self.counters.items())),
+                'slowest_files': self.profiles, 'slow_inputs': self.slow_inputs}
+
+    def log_summary(self, elapsed):
+        stats = self.to_dict(elapsed)
+        log.info('%s files, %s interventions, %s bytes in %.1fs (%.1f files/s, %.1f interventions/s, %.0f bytes/s)',
+                 self.counters['files'], self.counters['interventions'], self.counters['bytes'], elapsed,
+                 *stats['rates'].values())
+        # the stages of all the pool workers are added together
+        for stage in self.stages:
+            if stage in self.timers:
+                log.info('  %-10s %8.2fs', stage, self.timers[stage])
+        for name, rate in stats['cache_hit_rates'].items():
+            log.info('  %s cache hit rate %.1f%%', name, rate * 100)
+        for name, count in stats['counters'].items():
+            if not name.startswith('cache.') and name not in ['files', 'interventions', 'bytes']:
+                log.info('  %-30s %8s', name, count)
+        if self.profiles:
+            log.info('Slowest files:')
+        for profile in self.profiles:
+            log.info('  %s %.3fs, %.0f%% in regexes', profile['file'], profile['seconds'],
+                     profile['regex_share'] * 100)
+            for function in profile['top_functions']:
+                log.info('    %8.3fs %8.3fs %8s  %s', function['tottime'], function['cumtime'], function['calls'],
+                         function['function'])
+        for slow_input in self.slow_inputs:
+            log.warning('Slow %s input (%.3fs CPU, %s characters) in %s, possible regex backtracking: %s',
+                        slow_input['stage'], slow_input['cpu_seconds'], slow_input['length'], slow_input['file'],
+                        slow_input['text'])
+
+    def save(self, filename, elapsed):
+        write_json(filename, self.to_dict(elapsed))
+        log.info('Wrote run stats to %s', filename)
+
+
+run_stats = RunStats()
+
+
+def profile_call(name, function, *args):
+    """ Runs function under cProfile and adds it to the slowest files in
+        run_stats, with its top functions by own time and the share of time
+        spent in regex matching
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        seconds = time.perf_counter() - start
+        stats = pstats.Stats(profiler).stats
+        total = sum(entry[2] for entry in stats.values()) or 1
+        regex = sum(entry[2] for func, entry in stats.items() if is_regex_function(func))
+        top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:10]
+        top_functions = [{'function': pstats.func_std_string(func), 'calls': entry[1], 'tottime': entry[2],
+                          'cumtime': entry[3]} for func, entry in top]
+        run_stats.add_profiles([{'file': name, 'seconds': seconds, 'regex_share': regex / total,
+                                 'top_functions': top_functions}])
+
+
+def is_regex_function(func):
+    filename, line, name = func
+    return 're.Pattern' in name or os.path.basename(os.path.dirname(filename)) == 're' or \
+        name in ['<built-in method _sre.compile>', '<built-in method re.sub>']
+
+
+class SpeakerHeader():
+    """ Tokenizes a <SPEAKER ...> line once into its ID, NAME, AFFILIATION and
+        LANGUAGE attributes. Each field is found exactly as the previous
+        greedy regexes found it, e.g. the last NAME=" followed by a quote and
+        a closing >, but with string searches instead of backtracking:
+            ID           <.*SPEAKER ID="*([0-9]+)"* .*
+            NAME         <.*NAME="(.*?)".*>
+            AFFILIATION  <.*AFFILIATION="(.*)"/?>
+            LANGUAGE     <.*LANGUAGE="([A-Z][A-Z])".*>
+        Both ID=1 and ID="1" forms are accepted.
+    """
+
+    __slots__ = ('speech_id', 'name', 'affiliation', 'language')
+
+    uppercase = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+    def __init__(self, s):
+        self.speech_id = None
+        self.name = None
+        self.affiliation = None
+        self.language = None
+        if not s.startswith('<'):
+            return
+        if '\n' in s:
+            # . does not match a newline, so leave these to the regexes
+            self.parse_with_regexes(s)
+            return
+        self.speech_id = self.find_speech_id(s)
+        self.name = self.find_name(s)
+        self.affiliation = self.find_affiliation(s)
+        self.language = self.find_language(s)
+
+    def parse_with_regexes(self, s):
+        match = re.match(r'<.*SPEAKER ID="*([0-9]+)"* .*', s)
+        if match:
+            self.speech_id = match.group(1)
+        match = re.match(r'<.*NAME="(.*?)".*>', s)
+        if match:
+            self.name = match.group(1)
+        match = re.match(r'<.*AFFILIATION="(.*)"/?>', s)
+        if match:
+            self.affiliation = match.group(1)
+        match = re.match(r'<.*LANGUAGE="([A-Z][A-Z])".*>', s)
+        if match:
+            self.language = match.group(1)
+
+    @staticmethod
+    def find_speech_id(s):
+        end = len(s)
+        while True:
+            idx = s.rfind('SPEAKER ID=', 1, end)
+            if idx == -1:
+                return
+            end = idx + len('SPEAKER ID=') - 1
+            pos = idx + len('SPEAKER ID=')
+            while pos < len(s) and s[pos] == '"':
+                pos += 1
+            start = pos
+            while pos < len(s) and s[pos] in '0123456789':
+                pos += 1
+            speech_id = s[start:pos]
+            while pos < len(s) and s[pos] == '"':
+                pos += 1
+            if speech_id and pos < len(s) and s[pos] == ' ':
+                return speech_id
+
+    @staticmethod
+    def find_name(s):
+        last_gt = s.rfind('>')
+        end = len(s)
+        while True:
+            idx = s.rfind('NAME="', 1, end)
+            if idx == -1:
+                return
+            end = idx + len('NAME="') - 1
+            start = idx + len('NAME="')
+            quote = s.find('"', start)
+            if quote != -1 and quote < last_gt:
+                return s[start:quote]
+
+    @staticmethod
+    def find_affiliation(s):
+        quote = max(s.rfind('">'), s.rfind('"/>'))
+        if quote == -1:
+            return
+        idx = s.rfind('AFFILIATION="', 1, quote)
+        if idx == -1:
+            return
+        return s[idx + len('AFFILIATION="'):quote]
+
+    @staticmethod
+    def find_language(s):
+        last_gt = s.rfind('>')
+        end = len(s)
+        uppercase = SpeakerHeader.uppercase
+        while True:
+            idx = s.rfind('LANGUAGE="', 1, end)
+            if idx == -1:
+                return
+            end = idx + len('LANGUAGE="') - 1
+            start = idx + len('LANGUAGE="')
+            language = s[start:start + 2]
+            if len(language) == 2 and language[0] in uppercase and language[1] in uppercase and \
+               s[start + 2:start + 3] == '"' and start + 2 < last_gt:
+                return language
+
+
 class Intervention():
+    """ Once finalized, only speech_id, language, speakers and data are kept;
+        the raw header and the parsing state are released
+    """
+
+    __slots__ = ('speakers', 'language', 'possible_language', 'speech_id', 'data', 'data_parts', 's', 'header')
 
     valid_affiliations = ['ALDE', 'ERA', 'EPP-ED', 'G/EFA', 'V', 'UEN', 'EDD',
                           'ELDR', 'PES', 'EUL/NGL', 'I-EN', 'IND/DEM', 'NI',
                           'TGI', 'UFE', 'S&D', 'ECR', 'EFD', 'ITS']
 
     def __init__(self, s):
-        self.speakers = set()
+        self.speakers = []
         self.language = None
         self.possible_language = None
         self.speech_id = None
         self.data = ''
+        self.data_parts = []
 
         self.s = s.strip()
+        self.header = SpeakerHeader(self.s)
 
         self.parse_speaker()
         self.parse_names()
@@ -92,61 +511,81 @@ class Intervention():
         self.parse_language()
 
     def __repr__(self):
-        return pformat(dict(vars(self)), width=150)
+        from pprint import pformat
+        return pformat(slots_dict(self), width=150)
 
     def add_data(self, d):
-        data = d
-        data = re.sub(r'\s+', ' ', data)
-        data = data.replace('[amp]', '&')
-        data = data.replace('[...]', '')
-        data = data.replace('[…]', '')
-        data = data.replace('…', ' ')
-        data = data.replace('...', ' ')
-        data = re.sub(r'\[Article[^\]*]\]', '', data)
-        data = re.sub(r'\[[^\]]*\/[^\]]*\]', '', data)
-        data = data.replace('()', '')
-        data = data.replace('[]', '')
-        data = data.replace('[?]', '')
-        self.data += data.replace('<P>', '')
+        self.data_parts.append(self.clean_line(d))
+
+    @staticmethod
+    def clean_line(d):
+        """ The replacements are applied in the same order as always, but each
+            group is skipped when the line cannot contain what it removes
+        """
+        data = whitespace_regex.sub(' ', d)
+        if '[' in data:
+            data = data.replace('[amp]', '&')
+            data = data.replace('[...]', '')
+            data = data.replace('[…]', '')
+        if '…' in data:
+            data = data.replace('…', ' ')
+        if '...' in data:
+            data = data.replace('...', ' ')
+        if '[' in data:
+            data = article_regex.sub('', data)
+            data = bracketed_slash_regex.sub('', data)
+        if '()' in data:
+            data = data.replace('()', '')
+        if '[' in data:
+            data = data.replace('[]', '')
+            data = data.replace('[?]', '')
+        if '<P>' in data:
+            data = data.replace('<P>', '')
+        return data
 
     def finalize(self):
-        self.data = self.data.lstrip('. ').rstrip()
-        self.data = self.data.replace(' . ', '. ')
-        self.data = re.sub(r'([\.\?\!\,]) +', '\g<1> ', self.data)
-        self.data = re.sub(r' +', ' ', self.data)
-        self.replace_english_phrases()
+        data = ''.join(self.data_parts)
+        self.data_parts = None
+        self.s = None
+        self.header = None
+        self.possible_language = None
+        data = data.lstrip('. ').rstrip()
+        data = data.replace(' . ', '. ')
+        # collapsing all runs of spaces also collapses those after punctuation
+        data = spaces_regex.sub(' ', data)
+        self.data = english_phrases_regex.sub('', data)
         if not self.language:
             self.language = 'UNKNOWN'
         for speaker in self.speakers:
             if not speaker.affiliation:
                 speaker.affiliation = 'UNKNOWN'
-            all_speakers.add(speaker)
+        self.speakers = tuple(speaker_registry.intern(speaker) for speaker in self.speakers)
 
     def parse_speaker(self):
-        match = re.match(r'<.*SPEAKER ID="*([0-9]+)"* .*', self.s)
-        if match:
-            self.speech_id = match.group(1)
-            print(f'speech_id: {self.speech_id}')
+        if self.header.speech_id:
+            self.speech_id = self.header.speech_id
+            speaker_log.debug('speech_id: %s', self.speech_id)
         else:
-            print(f'speech_id not found: {self.s}')
+            speaker_log.debug('speech_id not found: %s', self.s)
 
     def parse_names(self):
-        match = re.match(r'<.*NAME="(.*?)".*>', self.s)
-        if not match:
-            print(f'name not found: {self.s}')
+        names = self.header.name
+        if names is None:
+            names_log.debug('name not found: %s', self.s)
+            run_stats.count('names.not_found')
             return
-        print(self.s)
-        names = match.group(1)
+        names_log.debug('%s', self.s)
         names = self.remove_non_names(names)
         names = self.split_names(names)
-        print(f'names: {names}')
+        names_log.debug('names: %s', names)
         if not names:
             return
         if len(names) == 1:
-            print(f'names1: {names}')
+            names_log.debug('names1: %s', names)
             if self.contains_conjunction(names):
                 # case where only one name is found but it contains a conjunction
-                print(f'case: [1] one name element found with conjunction "{self.s}"')
+                names_log.debug('case: [1] one name element found with conjunction "%s"', self.s)
+                run_stats.count('names.case1')
                 names = self.replace_conjunctions(names[0])
                 names = self.split_names(names)
                 speaker1 = self.create_speaker_from_name(names[0])
@@ -157,16 +596,18 @@ class Intervention():
                 self.add_speaker(speaker2)
             else:
                 # case where only one name is found, just create a speaker
-                print(f'case: [2] only one name element found "{self.s}"')
+                names_log.debug('case: [2] only one name element found "%s"', self.s)
+                run_stats.count('names.case2')
                 speaker = self.create_speaker_from_name(names[0])
                 self.add_speaker(speaker)
             return
         if len(names) == 2:
-            print(f'names2: {names}')
+            names_log.debug('names2: %s', names)
             amatch = re.match(r'\((.*)\)', names[1])
             if amatch:
                 # case where the second element is the affiliation only
-                print(f'case: [3] 2nd element contains an affiliation only "{self.s}"')
+                names_log.debug('case: [3] 2nd element contains an affiliation only "%s"', self.s)
+                run_stats.count('names.case3')
                 possible_affiliation = amatch.group(1)
                 possible_affiliation = self.process_affiliation(possible_affiliation)
                 if possible_affiliation:
@@ -178,7 +619,8 @@ class Intervention():
                 # names[1] is probably someone else
                 speaker1 = self.create_speaker_from_name(names[0])
                 if speaker1.possible_affiliation:
-                    print(f'case: [4] 1st element contains afffiliation, two different speakers "{self.s}"')
+                    names_log.debug('case: [4] 1st element contains afffiliation, two different speakers "%s"', self.s)
+                    run_stats.count('names.case4')
                     speaker2 = self.create_speaker_from_name(names[1])
                     self.add_speaker(speaker1)
                     self.add_speaker(speaker2)
@@ -188,7 +630,8 @@ class Intervention():
                     # this is probably a single person
                     speaker = self.create_speaker_from_name(names[1])
                     if speaker.possible_affiliation and len(names[0].split()) == 1:
-                        print(f'case: [5] 2 elements = single speaker "{self.s}"')
+                        names_log.debug('case: [5] 2 elements = single speaker "%s"', self.s)
+                        run_stats.count('names.case5')
                         speaker = self.create_speaker_from_name(f'{names[1]} {names[0]}')
                         self.add_speaker(speaker)
                         # assuming [lastname, firstname] but this could be wrong?
@@ -197,10 +640,12 @@ class Intervention():
                         if self.contains_conjunction(names):
                             # case where there are two elements but one contains conjunctions
                             # this means more than 2 speakers so we let the next section handle it
-                            print(f'case: [6] 2 elements with conjunctions "{self.s}"')
+                            names_log.debug('case: [6] 2 elements with conjunctions "%s"', self.s)
+                            run_stats.count('names.case6')
                         else:
                             # case where there are two elements only
-                            print(f'case: [7] 2 elements all other cases "{self.s}"')
+                            names_log.debug('case: [7] 2 elements all other cases "%s"', self.s)
+                            run_stats.count('names.case7')
                             # we assume [lastname, firstname]
                             speaker = self.create_speaker_from_name(f'{names[1]} {names[0]}')
                             self.add_speaker(speaker)
@@ -216,8 +661,9 @@ class Intervention():
             names = ','.join(names)
             names = self.replace_conjunctions(names)
             names = self.split_names(names)
+        run_stats.count('names.case8')
         for name in reversed(names):
-            print(f'case: [8] more than 2 elements "{self.s}"')
+            names_log.debug('case: [8] more than 2 elements "%s"', self.s)
             speaker = self.create_speaker_from_name(name)
             if not speaker.possible_affiliation and last_affiliation:
                 speaker.possible_affiliation = last_affiliation
@@ -225,67 +671,9 @@ class Intervention():
             self.add_speaker(speaker)
 
     def add_speaker(self, speaker):
-        print(f'adding speaker: "{speaker}"')
-        self.speakers.add(speaker)
-
-
-    def replace_english_phrases(self):
-        phrases = [
-            r'\(?Parliament adopted the resolution\)?',
-            r'\(?Parliament adopted the Commission proposal\)?',
-            r'\(?Parliament adopted the legislative resolution\)?',
-            r'\(?Parliament gave its assent\)?',
-            r'\(?Parliament rejected the motion for a resolution\)?',
-            r'\(?Parliament rejected the[^\)]*\)?',
-            r'\((?:The )?Parliament[^\)]*\)',
-            r'\(The [Hh]ouse[^\)]*\)',
-            r'\(*The Minutes were approved\)*',
-            r'\(* *Approval of the [Mm]inutes(?: of the previous sitting[s]?)? *\)*',
-            r'\(Explanation[s]? of (?:the )?vote[^\)]*\)',
-            r'\(For (?:the )?results [^\)]*\)',
-            r'\(For the outcome [^\)]*\)',
-            r'\(The explanation[^\)]*\)',
-            r'\(The Member[^\)]*\)',
-            r'\(Members[^\)]*\)',
-            r'\(The meeting was[^\)]*\)',
-            r'\(The oral amendment was[^\)]*\)',
-            r'\(The order of business[^\)]*\)',
-            r'\([Tt]he (?:formal )?sitting [^\)]*\)',
-            r'\([Tt]he speaker [^\)]*\)',
-            r'\([Tt]he request [^\)]*\)',
-            r'\([Tt]he report [^\)]*\)',
-            r'\([Tt]he session was [^\)]*\)',
-            r'\(The Commissioner [^\)]\)',
-            r'\(The President [^\)]\)',
-            r'\(The Assembly [^\)]\)',
-            r'\(The amendment [^\)]\)',
-            r'\(Text [^\)]\)',
-            r'\(Abbreviated [^\)]\)',
-            r'\(adopted [^\)]\)',
-            r'\(During successive [^\)]\)',
-            r'\([Tt]he proposal[^)]*\)',
-            r'\(The vote [^)]*\)',
-            r'\(Intervention cut short pursuant to[^\)]*\)',
-            r'\(In successive votes[^)]*\)',
-            r'\(Mixed react[^)]*\)',
-            r'\(Laughter and applause\)',
-            r'\(Laughter\)',
-            r'Statement by'
-            r'\(*Vigorous applause\)*',
-            r'\(*Loud applause\)*',
-            r'\([^\)]*[Aa]pplause[^\)]*\)',
-            r'\([^\)]*[Ll]aughter[^\)]*\)',
-            r'\([^\)]*[Hh]eckling[^\)]*\)',
-            r'\(*Murmurs of dissent\)*',
-            r'\(Exclamations\)',
-            r'\(Muted applause\)',
-            r'\(*Adjournment of the session\)*',
-            r'Report \([^\)]\/[^\)]*\)',
-            r'Draft Amendment No',
-        ]
-        r = '|'.join(phrases)
-        regex = re.compile(f'({r})')
-        self.data = regex.sub('', self.data)
+        names_log.debug('adding speaker: "%s"', speaker)
+        self.speakers.append(speaker)
+
 
     @staticmethod
     def contains_conjunction(s):
@@ -295,14 +683,15 @@ class Intervention():
         return False
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def process_affiliation(s):
         a = s
-        print(f'invalid before: {a}')
+        affiliation_log.debug('invalid before: %s', a)
         a = a.replace('(', '')
         a = a.replace(')', '')
         a = a.strip(',.–‘v ')
         a = re.sub(r' *(?:on behalf o[fn] )?(?:for)?(?:the)? ? ?(\S+) ? ?(?:[Gg]roup)?.*', '\g<1>', a)
-        print(f'invalid after: {a}')
+        affiliation_log.debug('invalid after: %s', a)
         a = a.replace('ARE', 'ERA')
         a = a.replace('PPE–DE', 'EPP-ED')
         a = a.replace('PPE-DE', 'EPP-ED')
@@ -320,8 +709,8 @@ class Intervention():
         if a and Intervention.is_valid_affiliation(a):
             return a
         else:
-            print(f'invalid affiliation: "{a}"')
-            print(f'invalid affiliation string: "{s}"')
+            affiliation_log.debug('invalid affiliation: "%s"', a)
+            affiliation_log.debug('invalid affiliation string: "%s"', s)
 
     @staticmethod
     def correct_language(s):
@@ -392,9 +781,9 @@ class Intervention():
         if not match:
             return Speaker(s)
         name = match.group(1).rstrip()
-        print(f'name: {name}')
+        names_log.debug('name: %s', name)
         possible_affiliation = Intervention.process_affiliation(match.group(2))
-        print(f'possible affiliation: {possible_affiliation}')
+        names_log.debug('possible affiliation: %s', possible_affiliation)
         return Speaker(name, possible_affiliation=possible_affiliation)
 
     @staticmethod
@@ -403,161 +792,1814 @@ class Intervention():
         if match:
             possible_language = match.group(1)
             if Intervention.is_valid_language(possible_language):
-                print(f'possible lang: {possible_language}')
+                language_log.debug('possible lang: %s', possible_language)
                 return possible_language
 
     def parse_affiliation(self):
-        match = re.match(r'<.*AFFILIATION="(.*)"/?>', self.s)
-        if match:
-            m = match.group(1)
+        m = self.header.affiliation
+        if m is not None:
             self.possible_language = Intervention.find_possible_language(m)
             affiliation = self.process_affiliation(m)
             if affiliation:
                 for speaker in self.speakers:
                     speaker.affiliation = affiliation
-                    print(f'affiliation: {speaker.affiliation}')
+                    affiliation_log.debug('affiliation: %s', speaker.affiliation)
                     a = speaker.affiliation
                     pa = speaker.possible_affiliation
                     if pa and a != pa:
-                        print(f'affiliation mismatch: "{a}" vs "{pa}" -> "{self.s}"')
+                        affiliation_log.debug('affiliation mismatch: "%s" vs "%s" -> "%s"', a, pa, self.s)
                 return
+            run_stats.count('affiliation.invalid_attribute')
         for speaker in self.speakers:
             pa = speaker.possible_affiliation
             if pa:
                 speaker.affiliation = pa
-                print(f'affiliation: {pa}')
+                affiliation_log.debug('affiliation: %s', pa)
+                run_stats.count('affiliation.from_name')
             else:
-                print(f'invalid affiliation: {pa}')
+                affiliation_log.debug('invalid affiliation: %s', pa)
+                run_stats.count('affiliation.invalid')
         else:
-            print(f'affiliation not found: {self.s}')
+            affiliation_log.debug('affiliation not found: %s', self.s)
 
     @staticmethod
     def is_valid_language(l):
         return l in valid_langs
 
     def parse_language(self):
-        match = re.match(r'<.*LANGUAGE="([A-Z][A-Z])".*>', self.s)
-        if match:
-            language = match.group(1)
+        language = self.header.language
+        if language:
             language = self.correct_language(language)
             if self.is_valid_language(language):
-                print(f'language: {language}')
+                language_log.debug('language: %s', language)
                 self.language = language
+                run_stats.count('language.attribute')
                 return
             else:
-                print(f'invalid language: {language}')
+                language_log.debug('invalid language: %s', language)
+                run_stats.count('language.invalid')
         if self.possible_language:
-            print(f'language: {self.possible_language}')
+            language_log.debug('language: %s', self.possible_language)
             self.language = self.possible_language
+            run_stats.count('language.bracketed')
             return
-        print(f'language not found: {self.s}')
+        language_log.debug('language not found: %s', self.s)
 
 
-def process():
-    corpus_lang = args.language.lower()
-    input_path = f'./txt/{corpus_lang}'
-    output_path = f'./xml/{corpus_lang}'
-    Path(output_path).mkdir(parents=True, exist_ok=True)
+bracketed_languages = '|'.join(valid_langs)
+unquoted_id_regex = re.compile(r'ID=([0-9]+)')
+leading_language_regex = re.compile(rf'^ *\(({bracketed_languages})\) *')
+speaker_id_regex = re.compile(r'(KER ID="[0-9]+")')
+name_language_regex = re.compile(r'(NAME=".*")(.*)(LANGUAGE=".*") *>')
+duplicate_language_regex = re.compile(r'(LANGUAGE="[A-Z][A-Z]") \1')
+second_language_regex = re.compile(r'(LANGUAGE="[A-Z][A-Z]") LANGUAGE="[A-Z]*[A-Z]*"')
 
-    if args.file:
-        file_dir = '/'.join(args.file.split('/')[:-1])
-        files = [os.fsencode(args.file.split('/')[-1:][0])]
-    else:
-        files = os.listdir(os.fsencode(input_path))
 
-    for f in files:
-        if len(f) != 15:
-            print(f'{f} not correct length: {len(f)}')
+def preprocess_lines(lines):
+    """ Streaming port of the SPEAKER header fixes that convert_file() in
+        europarl-parser.sh makes with sed: tags are split onto their own
+        lines, a language in brackets at the start of a speech is moved into
+        a LANGUAGE attribute, IDs are quoted, LANGUAGE is moved before NAME,
+        duplicate languages are removed (keeping the bracketed one, which is
+        usually correct) and & in headers becomes "and". Empty languages are
+        then left to the LanguageIndex rather than missing_languages().
+    """
+    header = None
+    for line in split_tags(lines):
+        if header is not None:
+            match = leading_language_regex.match(line)
+            if match:
+                header = speaker_id_regex.sub(rf'\1 LANGUAGE="{match.group(1)}"', header, count=1)
+                line = line[match.end():]
+            yield fix_header(header)
+            header = None
+        if line.startswith('<SPEAKER'):
+            header = line
             continue
-        filename = os.fsdecode(f)
-        input_filename = os.path.join(input_path, filename)
-        interventions = []
-        with open(input_filename) as ifile:
-            print(f'Processing {input_filename}')
-            speaker_section = False
-            for line in ifile:
-                if line.startswith('<CHAPTER') or line.startswith('VOTE') or \
-                   line.startswith('The sitting was ') or line.startswith('Votes') or \
-                   line.startswith('Statement by '):
-                    speaker_section = False
+        yield line
+    if header is not None:
+        yield fix_header(header)
+
+
+def split_tags(lines):
+    for line in lines:
+        if not line.startswith('<'):
+            yield line
+            continue
+        line = unquoted_id_regex.sub(r'ID="\1"', line)
+        end = line.find('>') + 1
+        if not end or not line[end:].strip():
+            yield line
+            continue
+        # s/> \?/>\n/ for text following a tag
+        yield line[:end] + '\n'
+        rest = line[end:]
+        yield rest[1:] if rest.startswith(' ') else rest
+
+
+def fix_header(header):
+    header = header.replace('S&amp;D', 'S-D').replace('&', 'and')
+    header = name_language_regex.sub(r'\3 \1\2>', header)
+    header = duplicate_language_regex.sub(r'\1', header)
+    return second_language_regex.sub(r'\1', header)
+
+
+session_file_regex = re.compile(r'^(ep-[0-9][0-9]-[0-9][0-9]-[0-9][0-9])(?:-([0-9]{3})(?:-([0-9][0-9]))?)?\.txt(\.orig)?$')
+
+
+def group_session_files(members):
+    """ Returns {session filename: [member filenames]}. In later years a
+        session is split into ep-yy-mm-dd-NNN.txt files, some of which are
+        split again into ep-yy-mm-dd-NNN-NN.txt files. These are read as one
+        ep-yy-mm-dd.txt session: each NNN part followed by its NN fragments,
+        where a file whose last line has no newline is ended there rather than
+        run into the SPEAKER header of the next one as cat would (chain_lines).
+        europarl-parser.sh -p appends the NN fragments to their
+        ep-yy-mm-dd-NNN.txt and then concatenates ep-yy-mm-dd-*.txt into
+        ep-yy-mm-dd.txt, where the glob puts -NNN-NN.txt before -NNN.txt and so
+        repeats them. Once -p has run (an ep-yy-mm-dd.txt is next to its
+        fragments), only the NNN parts are read, unless a part has a .orig backup.
+    """
+    sessions = {}
+    fragments = {}
+    for member in members:
+        match = session_file_regex.match(member)
+        if not match:
+            continue
+        base, part, subpart, orig = match.groups()
+        if part is None:
+            if not orig:
+                sessions[member] = [member]
+            continue
+        if orig and subpart:
+            continue
+        fragments.setdefault(f'{base}.txt', {}).setdefault((part, subpart or ''), []).append((bool(orig), member))
+    for session, parts in fragments.items():
+        concatenated = session in sessions
+        files = []
+        for part, subpart in sorted(parts):
+            if subpart and concatenated and not max(parts.get((part, ''), [(False, None)]))[0]:
+                # already appended to ep-yy-mm-dd-NNN.txt by -p
+                continue
+            files.append(max(parts[part, subpart])[1])
+        # a fragmented session replaces the ep-yy-mm-dd.txt made by -p
+        sessions[session] = files
+    return sessions
+
+
+def chain_lines(parts):
+    """ Yields the lines of several files one after the other. Unlike cat, a
+        last line without a newline is ended before the next file, so that a
+        SPEAKER header at the start of the next file still starts a line
+    """
+    last = None
+    for lines in parts:
+        if last is not None:
+            yield last if last.endswith('\n') else last + '\n'
+            last = None
+        for line in lines:
+            if last is not None:
+                yield last
+            last = line
+    if last is not None:
+        yield last
+
+
+class Corpus():
+    """ Common to all the input backends. Session files are addressed by
+        (lang, filename), where a fragmented session is addressed by the name
+        of the session it is part of, e.g. ep-07-01-15.txt.
+    """
+
+    compressed = False
+    preprocess = False
+
+    def get_sessions(self, lang):
+        if lang not in self.sessions:
+            self.sessions[lang] = group_session_files(self.list_members(lang))
+        return self.sessions[lang]
+
+    def get_parts(self, lang, filename):
+        return self.get_sessions(lang).get(filename, [])
+
+    def list_files(self, lang):
+        return sorted(self.get_sessions(lang))
+
+    def stat(self, lang, filename):
+        parts = self.get_parts(lang, filename)
+        if not parts:
+            return None
+        if parts == [filename]:
+            return self.stat_member(lang, filename)
+        stats = [self.stat_member(lang, part) for part in parts]
+        return [sum(stat[0] for stat in stats), max(stat[1] for stat in stats), len(stats)]
+
+    def signature(self, lang, filename):
+        """ The stat and sha1 of a session file. A file is hashed once for as
+            long as its stat is unchanged, as it is an input of the session in
+            every language that consults it
+        """
+        stat = self.stat(lang, filename)
+        if not stat:
+            return None
+        key = f'{lang}/{filename}'
+        signature = self.signatures.get(key)
+        if signature and signature['stat'] == stat:
+            return signature
+        import hashlib
+        h = hashlib.sha1()
+        for part in self.get_parts(lang, filename):
+            h.update(self.read_member(lang, part))
+        signature = {'stat': stat, 'sha1': h.hexdigest()}
+        self.signatures[key] = signature
+        return signature
+
+    def read_lines(self, lang, filename):
+        parts = self.get_parts(lang, filename)
+        if not parts:
+            raise FileNotFoundError(self.get_name(lang, filename))
+        lines = chain_lines(self.iter_member_lines(lang, part) for part in parts)
+        if self.preprocess:
+            yield from preprocess_lines(lines)
+        else:
+            yield from lines
+
+    def iter_member_lines(self, lang, member):
+        with self.open_member(lang, member) as ifile:
+            yield from ifile
+
+    def map_session(self, lang, filename):
+        """ Returns the raw bytes of a session file, with its fragments joined
+            as chain_lines joins them, without decoding them
+        """
+        parts = self.get_parts(lang, filename)
+        if not parts:
+            raise FileNotFoundError(self.get_name(lang, filename))
+        data = [self.read_member(lang, part) for part in parts]
+        return b''.join(d + b'\n' if d and not d.endswith(b'\n') and n < len(data) - 1 else d
+                        for n, d in enumerate(data))
+
+    def order_keys(self, keys):
+        """ The order in which to read many lang/filename keys """
+        return sorted(keys)
+
+    def refresh(self):
+        """ Forget the listing of session files, so that new files are seen """
+        self.sessions = {}
+
+
+class DirectoryCorpus(Corpus):
+    """ Session files that have been extracted to <base_path>/<lang>/<filename> """
+
+    def __init__(self, base_path='./txt', preprocess=False, use_mmap=True):
+        self.base_path = base_path
+        self.preprocess = preprocess
+        self.use_mmap = use_mmap
+        self.sessions = {}
+        self.signatures = {}
+        self.missing = set()
+
+    def get_name(self, lang, filename):
+        return os.path.join(self.base_path, lang, filename)
+
+    def list_files(self, lang):
+        input_path = os.path.join(self.base_path, lang)
+        if not os.path.isdir(input_path):
+            if lang not in self.missing:
+                log.warning('%s does not exist', input_path)
+            self.missing.add(lang)
+        else:
+            self.missing.discard(lang)
+        return super().list_files(lang)
+
+    def list_members(self, lang):
+        try:
+            return os.listdir(os.path.join(self.base_path, lang))
+        except FileNotFoundError:
+            return []
+
+    def stat_member(self, lang, member):
+        return file_stat(self.get_name(lang, member))
+
+    def read_member(self, lang, member):
+        with open(self.get_name(lang, member), 'rb') as ifile:
+            return ifile.read()
+
+    def map_session(self, lang, filename):
+        """ A session in a single file is memory-mapped rather than read,
+            unless use_mmap is off because the file may be truncated while it
+            is mapped, which raises SIGBUS rather than an exception
+        """
+        parts = self.get_parts(lang, filename)
+        if len(parts) != 1 or not self.use_mmap:
+            return super().map_session(lang, filename)
+        with open(self.get_name(lang, parts[0]), 'rb') as ifile:
+            if not os.fstat(ifile.fileno()).st_size:
+                return b''
+            return mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_member_range(self, lang, member, offset, length):
+        with open(self.get_name(lang, member), 'rb') as ifile:
+            ifile.seek(offset)
+            return ifile.read(length)
+
+    def open_member(self, lang, member):
+        return open(self.get_name(lang, member))
+
+
+class TarCorpus(Corpus):
+    """ Session files read straight out of europarl.tgz, without extracting it.
+        The archive is scanned once for the offset of each txt/<lang>/<filename>
+        member, and this member index is saved next to the archive.
+        Members of an uncompressed tar can be read with a single seek; in a
+        compressed archive seeking means decompressing, so members should be
+        read in archive order (see iter_files). Running gunzip on the archive
+        once gives a europarl.tar with cheap random access.
+    """
+
+    def __init__(self, archive_filename, preprocess=False):
+        self.archive_filename = archive_filename
+        self.preprocess = preprocess
+        self.sessions = {}
+        self.signatures = {}
+        self.members_filename = f'{archive_filename}.members.json'
+        self.fileobj = None
+        with open(archive_filename, 'rb') as ifile:
+            self.compressed = ifile.read(2) == b'\x1f\x8b'
+        self.members = self.load_members()
+
+    def __getstate__(self):
+        # each pool worker opens its own handle on the archive
+        state = dict(vars(self))
+        state['fileobj'] = None
+        return state
+
+    def load_members(self):
+        stat = file_stat(self.archive_filename)
+        try:
+            with open(self.members_filename) as ifile:
+                data = json.load(ifile)
+            if data['stat'] == stat:
+                return data['members']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        log.info('Indexing members of %s', self.archive_filename)
+        import tarfile
+        members = {}
+        with tarfile.open(self.archive_filename, 'r|*') as tar:
+            for member in tar:
+                parts = member.name.split('/')
+                if not member.isfile() or len(parts) < 2 or len(parts[-2]) != 2:
                     continue
-                if line.startswith('Applause') or line.startswith('Loud applause') or \
-                   line.startswith('Loud and sustained applause') or line.startswith('Loud Applause') or \
-                   line.startswith('Sustained applause'):
+                members[f'{parts[-2]}/{parts[-1]}'] = [member.offset_data, member.size, member.mtime]
+        try:
+            write_json(self.members_filename, {'stat': stat, 'members': members})
+        except OSError as e:
+            log.warning('Could not save member index %s: %s', self.members_filename, e)
+        return members
+
+    def get_name(self, lang, filename):
+        return f'{self.archive_filename}:{lang}/{filename}'
+
+    def list_members(self, lang):
+        prefix = f'{lang}/'
+        return [key[len(prefix):] for key in self.members if key.startswith(prefix)]
+
+    def stat_member(self, lang, member):
+        offset, size, mtime = self.members[f'{lang}/{member}']
+        return [size, mtime]
+
+    def read_member(self, lang, member):
+        offset, size, mtime = self.members[f'{lang}/{member}']
+        return self.read_archive(offset, size)
+
+    def read_member_range(self, lang, member, offset, length):
+        member_offset, size, mtime = self.members[f'{lang}/{member}']
+        return self.read_archive(member_offset + offset, min(length, size - offset))
+
+    def read_archive(self, offset, size):
+        if not self.fileobj:
+            if self.compressed:
+                import gzip
+                self.fileobj = gzip.open(self.archive_filename, 'rb')
+            else:
+                self.fileobj = open(self.archive_filename, 'rb')
+        self.fileobj.seek(offset)
+        return self.fileobj.read(size)
+
+    def open_member(self, lang, member):
+        return io.TextIOWrapper(io.BytesIO(self.read_member(lang, member)), encoding='utf-8')
+
+    def iter_files(self, keys):
+        """ Yields (lang, filename, lines) in archive order, so that a compressed
+            archive is only read forwards
+        """
+        for key in self.order_keys(keys):
+            lang, filename = key.split('/')
+            yield lang, filename, self.read_lines(lang, filename)
+
+    def order_keys(self, keys):
+        """ Archive order, skipping keys that are not in the archive """
+        offsets = {}
+        for key in keys:
+            lang, filename = key.split('/')
+            parts = self.get_parts(lang, filename)
+            if parts:
+                offsets[key] = self.members[f'{lang}/{parts[0]}'][0]
+        return sorted(offsets, key=offsets.get)
+
+
+def open_corpus(input_path, preprocess=False):
+    if os.path.isfile(input_path):
+        return TarCorpus(input_path, preprocess)
+    return DirectoryCorpus(input_path, preprocess)
+
+
+class LanguageIndex():
+    """ Maps SPEAKER ID -> LANGUAGE for each session file in each language
+        directory, so that UNKNOWN languages can be resolved by a dictionary
+        lookup rather than by rescanning the other language files.
+        Each (lang, filename) is scanned at most once, and the index can be
+        persisted to a json file to be reused across runs. Persisted entries
+        are rescanned if the size or mtime of their file has changed.
+    """
+
+    speaker_language_regex = re.compile(r'SPEAKER ID="?([0-9]+)"? .*LANGUAGE="([A-Z][A-Z])"')
+    speaker_language_bytes_regex = re.compile(rb'SPEAKER ID="?([0-9]+)"? .*LANGUAGE="([A-Z][A-Z])"')
+    recent_sessions = 32
+
+    def __init__(self, corpus, index_filename=None, keep=False):
+        self.corpus = corpus
+        self.index_filename = index_filename
+        self.keep = keep
+        self.files = {}
+        self.new_keys = set()
+        self.checked = set()
+        self.consulted = {}
+        self.converted = collections.OrderedDict()
+        if index_filename and os.path.exists(index_filename):
+            with open(index_filename) as ifile:
+                self.files = json.load(ifile)
+            index_log.info('Loaded language index %s', index_filename)
+
+    def get_file_index(self, lang, filename):
+        key = f'{lang}/{filename}'
+        if key in self.checked:
+            run_stats.count('cache.language_index.hits')
+        else:
+            run_stats.count('cache.language_index.misses')
+            entry = self.files.get(key)
+            stat = self.corpus.stat(lang, filename)
+            if not self.is_current(entry, stat):
+                self.files[key] = self.make_entry(stat, self.scan_file(lang, filename))
+                self.new_keys.add(key)
+                run_stats.count('language_index.scans')
+            self.checked.add(key)
+        return self.files[key]['ids']
+
+    def make_entry(self, stat, ids):
+        return {'stat': stat, 'preprocessed': self.corpus.preprocess, 'ids': ids}
+
+    def is_current(self, entry, stat):
+        """ Entries are rescanned if their file changed, or if they were
+            scanned with preprocessing switched the other way
+        """
+        return entry and entry.get('stat') == stat and \
+            entry.get('preprocessed', False) == self.corpus.preprocess
+
+    def scan_file(self, lang, filename):
+        try:
+            index_log.debug('Indexing %s for unknown languages', self.corpus.get_name(lang, filename))
+            if not self.corpus.preprocess:
+                data = self.corpus.map_session(lang, filename)
+                if data.find(b'\r') == -1:
+                    return self.scan_data(data)
+            return self.scan_lines(self.corpus.read_lines(lang, filename))
+        except FileNotFoundError:
+            index_log.debug('%s does not exist', self.corpus.get_name(lang, filename))
+        return {}
+
+    def scan_data(self, data):
+        """ As scan_lines, over the undecoded bytes of a whole file """
+        file_index = {}
+        for match in self.speaker_language_bytes_regex.finditer(data):
+            speech_id, new_lang = match.group(1).decode(), match.group(2).decode()
+            if new_lang in valid_langs:
+                file_index.setdefault(speech_id, new_lang)
+            else:
+                index_log.debug('bad new_lang: %s', new_lang)
+        return file_index
+
+    def scan_lines(self, lines):
+        file_index = {}
+        for line in lines:
+            match = self.speaker_language_regex.search(line)
+            if not match:
+                continue
+            speech_id, new_lang = match.groups()
+            if new_lang in valid_langs:
+                file_index.setdefault(speech_id, new_lang)
+            else:
+                index_log.debug('bad new_lang: %s', new_lang)
+        return file_index
+
+    def prefetch(self, tasks):
+        """ Indexes all the other language files for these (lang, filename)
+            tasks in one pass over a compressed archive, rather than seeking
+            back and forth in it for every lookup
+        """
+        if not self.corpus.compressed:
+            return
+        keys = set()
+        for corpus_lang, filename in tasks:
+            for lang in valid_langs:
+                la = lang.lower()
+                if la == corpus_lang:
                     continue
-                if 'SPEAKER' in line:
-                    speaker_section = True
-                    i = Intervention(line)
-                    interventions.append(i)
+                key = f'{la}/{filename}'
+                entry = self.files.get(key)
+                stat = self.corpus.stat(la, filename)
+                if self.is_current(entry, stat):
+                    self.checked.add(key)
+                elif not stat:
+                    self.files[key] = self.make_entry(None, {})
+                    self.checked.add(key)
                 else:
-                    if speaker_section:
-                        i.add_data(line)
-        for i in interventions:
-            i.finalize()
-            if i.language == 'UNKNOWN':
-                for lang in valid_langs:
-                    if i.language != 'UNKNOWN':
-                        break
-                    la = lang.lower()
-                    if corpus_lang == la:
+                    keys.add(key)
+        if keys:
+            index_log.info('Indexing %s files for unknown languages', len(keys))
+        for lang, filename, lines in self.corpus.iter_files(keys):
+            key = f'{lang}/{filename}'
+            ids = self.scan_lines(lines)
+            self.files[key] = self.make_entry(self.corpus.stat(lang, filename), ids)
+            self.new_keys.add(key)
+            self.checked.add(key)
+
+    def lookup(self, filename, speech_id, exclude=None):
+        for lang in valid_langs:
+            la = lang.lower()
+            if la == exclude:
+                continue
+            self.consulted.setdefault(filename, set()).add(f'{la}/{filename}')
+            new_lang = self.get_file_index(la, filename).get(speech_id)
+            if new_lang:
+                return new_lang
+
+    def forget(self, filename):
+        """ Drop the entries for the session files converted longest ago,
+            keeping those of the last recent_sessions, so that converting the
+            other languages of a session soon after does not rescan them.
+            Nothing is dropped if the index is being persisted or kept.
+        """
+        if self.index_filename or self.keep:
+            return
+        self.converted[filename] = True
+        self.converted.move_to_end(filename)
+        while len(self.converted) > self.recent_sessions:
+            old_filename, _ = self.converted.popitem(last=False)
+            for lang in valid_langs:
+                key = f'{lang.lower()}/{old_filename}'
+                self.files.pop(key, None)
+                self.new_keys.discard(key)
+                self.checked.discard(key)
+
+    def refresh(self):
+        """ Check the files again on their next lookup, in case they changed """
+        self.checked.clear()
+
+    def take_consulted(self, filename):
+        """ Returns the other language files (as lang/filename) that were
+            needed to resolve UNKNOWN languages in a session file
+        """
+        return sorted(self.consulted.pop(filename, ()))
+
+    def take_new(self):
+        """ Returns the entries scanned since the last call, so that pool
+            workers can hand them back to be persisted by the parent
+        """
+        if not self.index_filename:
+            return {}
+        new = {key: self.files[key] for key in self.new_keys if key in self.files}
+        self.new_keys.clear()
+        return new
+
+    def update(self, entries):
+        self.files.update(entries)
+        self.new_keys.update(entries)
+
+    def save(self):
+        if not self.index_filename or not self.new_keys:
+            return
+        write_json(self.index_filename, self.files)
+        self.new_keys.clear()
+        index_log.info('Saved language index %s', self.index_filename)
+
+
+class AlignmentIndex():
+    """ Maps (session date, SPEAKER ID) to the byte offset and length of that
+        speech, from its SPEAKER line up to the next SPEAKER or CHAPTER line,
+        in the session file of every language directory. All the translations
+        of a speech can then be read with one seek per language, e.g.
+        AlignmentIndex(open_corpus('./txt'), 'alignment.sqlite').read_speech('2000-01-17', '2')
+        The index is kept in SQLite so that lookups do not load it all, and
+        only session files whose size or mtime changed are rescanned.
+        Offsets are into the member file, which for a fragmented session is
+        one of its fragments, so the raw input files are addressed and
+        --preprocess does not apply.
+    """
+
+    boundary_regex = re.compile(rb'^<(SPEAKER|CHAPTER)\b[^\n]*', re.MULTILINE)
+    speaker_id_regex = re.compile(rb'ID="?([0-9]+)')
+    schema = ['CREATE TABLE IF NOT EXISTS files (lang TEXT, filename TEXT, stat TEXT, '
+              'PRIMARY KEY (lang, filename)) WITHOUT ROWID',
+              'CREATE TABLE IF NOT EXISTS speeches (date TEXT, speech_id TEXT, lang TEXT, member TEXT, '
+              'offset INTEGER, length INTEGER, PRIMARY KEY (date, speech_id, lang)) WITHOUT ROWID']
+
+    def __init__(self, corpus, index_filename):
+        self.corpus = corpus
+        self.index_filename = index_filename
+        import sqlite3
+        self.db = sqlite3.connect(index_filename)
+        with self.db:
+            for statement in self.schema:
+                self.db.execute(statement)
+
+    def build(self):
+        """ Brings the index up to date with every session file in every
+            language directory
+        """
+        stats = dict(self.db.execute('SELECT lang || \'/\' || filename, stat FROM files'))
+        keys = set()
+        for lang in valid_langs:
+            la = lang.lower()
+            for filename in self.corpus.get_sessions(la):
+                if len(filename) != 15:
+                    continue
+                key = f'{la}/{filename}'
+                stat = json.dumps(self.corpus.stat(la, filename))
+                if stats.pop(key, None) != stat:
+                    keys.add(key)
+        with self.db:
+            # sessions that no longer exist
+            for key in stats:
+                self.remove(*key.split('/'))
+        log.info('Indexing %s session files for alignment', len(keys))
+        for n, key in enumerate(self.corpus.order_keys(keys), 1):
+            lang, filename = key.split('/')
+            with self.db:
+                self.remove(lang, filename)
+                self.db.executemany('INSERT OR IGNORE INTO speeches VALUES (?, ?, ?, ?, ?, ?)',
+                                    self.scan_file(lang, filename))
+                self.db.execute('INSERT INTO files VALUES (?, ?, ?)',
+                                (lang, filename, json.dumps(self.corpus.stat(lang, filename))))
+            if n % 1000 == 0:
+                log.info('Indexed %s/%s session files', n, len(keys))
+
+    def remove(self, lang, filename):
+        self.db.execute('DELETE FROM files WHERE lang = ? AND filename = ?', (lang, filename))
+        self.db.execute('DELETE FROM speeches WHERE date = ? AND lang = ?', (get_session_date(filename), lang))
+
+    def scan_file(self, lang, filename):
+        """ Yields a speeches row for each SPEAKER in a session file """
+        date = get_session_date(filename)
+        index_log.debug('Indexing %s for alignment', self.corpus.get_name(lang, filename))
+        for member in self.corpus.get_parts(lang, filename):
+            data = self.corpus.read_member(lang, member)
+            boundaries = list(self.boundary_regex.finditer(data))
+            for n, match in enumerate(boundaries):
+                if match.group(1) != b'SPEAKER':
+                    continue
+                speaker_id = self.speaker_id_regex.search(match.group(0))
+                if not speaker_id:
+                    index_log.debug('SPEAKER without ID: %s', match.group(0))
+                    continue
+                end = boundaries[n + 1].start() if n + 1 < len(boundaries) else len(data)
+                yield date, speaker_id.group(1).decode(), lang, member, match.start(), end - match.start()
+
+    def get_speech(self, date, speech_id):
+        """ Returns {lang: (member, offset, length)} for a speech """
+        rows = self.db.execute('SELECT lang, member, offset, length FROM speeches WHERE date = ? AND speech_id = ?',
+                               (date, str(speech_id)))
+        return {lang: (member, offset, length) for lang, member, offset, length in rows}
+
+    def read_speech(self, date, speech_id, langs=None):
+        """ Returns {lang: text} of a speech in each language, or in langs """
+        texts = {}
+        for lang, (member, offset, length) in self.get_speech(date, speech_id).items():
+            if langs and lang not in langs:
+                continue
+            texts[lang] = self.corpus.read_member_range(lang, member, offset, length).decode('utf-8')
+        return texts
+
+    def close(self):
+        self.db.close()
+
+
+def file_stat(filename):
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def write_json(filename, data):
+    """ Written to a temporary file first so that an interrupted run never
+        leaves a truncated file behind
+    """
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'w') as ofile:
+        json.dump(data, ofile)
+    os.replace(tmp_filename, filename)
+
+
+def get_converter_version(options=()):
+    """ Any change to the conversion rules changes this script, so its hash,
+        along with any options that change the output, is used as the
+        converter version
+    """
+    import hashlib
+    h = hashlib.sha1()
+    with open(os.path.realpath(__file__), 'rb') as ifile:
+        h.update(ifile.read())
+    for option in options:
+        h.update(f'\0{option}'.encode())
+    return h.hexdigest()
+
+
+class Manifest():
+    """ Records, for each output xml file, the converter version and the
+        signature of every input used to create it: the session file itself
+        and the other language files consulted for UNKNOWN languages.
+        A file only needs to be converted again if one of these changed.
+        Inputs are recorded as lang/filename, so that switching between an
+        extracted corpus and the archive only costs a rehash.
+        Without a manifest_filename it is only kept in memory.
+    """
+
+    version = 2
+    save_interval = 60
+
+    def __init__(self, manifest_filename, options=()):
+        self.manifest_filename = manifest_filename
+        self.converter_version = get_converter_version(options)
+        self.files = {}
+        self.modified = False
+        self.saved_at = time.monotonic()
+        if manifest_filename and os.path.exists(manifest_filename):
+            with open(manifest_filename) as ifile:
+                data = json.load(ifile)
+            if data.get('version') == self.version:
+                self.files = data['files']
+            log.info('Loaded manifest %s', manifest_filename)
+
+    def is_up_to_date(self, output_filename, corpus):
+        entry = self.files.get(output_filename)
+        if not entry or entry['converter'] != self.converter_version:
+            return False
+        if not os.path.exists(output_filename):
+            return False
+        for key, signature in entry['inputs'].items():
+            lang, filename = key.split('/')
+            stat = corpus.stat(lang, filename)
+            if not signature or not stat:
+                if signature or stat:
+                    return False
+                continue
+            if stat == signature['stat']:
+                continue
+            # touched but possibly unchanged, so compare the contents
+            new_signature = corpus.signature(lang, filename)
+            if not new_signature or new_signature['sha1'] != signature['sha1']:
+                return False
+            entry['inputs'][key] = new_signature
+            self.modified = True
+        return True
+
+    def record(self, output_filename, inputs):
+        self.files[output_filename] = {'converter': self.converter_version, 'inputs': inputs}
+        self.modified = True
+
+    def checkpoint(self):
+        """ Saves the manifest if it has not been saved for save_interval
+            seconds, so that an interrupted run loses little without the whole
+            file being rewritten every few conversions
+        """
+        if time.monotonic() - self.saved_at >= self.save_interval:
+            self.save()
+
+    def save(self):
+        self.saved_at = time.monotonic()
+        if not self.manifest_filename or not self.modified:
+            return
+        write_json(self.manifest_filename, {'version': self.version, 'files': self.files})
+        self.modified = False
+        log.debug('Saved manifest %s', self.manifest_filename)
+
+
+def get_session_date(filename):
+    year, month, day = filename.replace('.txt', '').replace('ep-', '').split('-')
+    if int(year) < 50:
+        century = '20'
+    else:
+        century = '19'
+    return f'{century}{year}-{month}-{day}'
+
+
+def get_output_filename(corpus_lang, filename):
+    return corpus_lang.upper() + get_session_date(filename).replace('-', '') + '.xml'
+
+
+def iter_interventions(input_filename, language_index=None):
+    """ Yields each finalized Intervention in a session file as soon as its
+        text is complete, so that a session is never held in memory.
+        If a LanguageIndex is given, UNKNOWN languages are resolved against
+        the same session file in the other language directories.
+    """
+    corpus_lang = os.path.basename(os.path.dirname(input_filename))
+    filename = os.path.basename(input_filename)
+    with open(input_filename) as ifile:
+        log.info('Processing %s', input_filename)
+        yield from parse_interventions(ifile, corpus_lang, filename, language_index)
+
+
+section_end_prefixes = ('<CHAPTER', 'VOTE', 'The sitting was ', 'Votes', 'Statement by ')
+applause_prefixes = ('Applause', 'Loud applause', 'Loud and sustained applause', 'Loud Applause',
+                     'Sustained applause')
+section_end_prefixes_bytes = tuple(p.encode() for p in section_end_prefixes)
+applause_prefixes_bytes = tuple(p.encode() for p in applause_prefixes)
+# the lines that can start or end a speech
+boundary_line_regex = re.compile(rb'^(?:<CHAPTER|VOTE|The sitting was |Votes|Statement by |[^\n]*SPEAKER)',
+                                 re.MULTILINE)
+
+
+def parse_interventions(lines, corpus_lang, filename, language_index=None):
+    i = None
+    speaker_section = False
+    for line in lines:
+        if line.startswith(section_end_prefixes):
+            speaker_section = False
+            continue
+        if line.startswith(applause_prefixes):
+            continue
+        if 'SPEAKER' in line:
+            speaker_section = True
+            if i:
+                yield finalize_intervention(i, filename, corpus_lang, language_index)
+            start = time.perf_counter()
+            cpu_start = time.thread_time()
+            i = Intervention(line)
+            run_stats.check_input('parse', f'{corpus_lang}/{filename}', line, time.thread_time() - cpu_start)
+            run_stats.add_time('parse', time.perf_counter() - start)
+        else:
+            if speaker_section:
+                start = time.perf_counter()
+                i.add_data(line)
+                run_stats.add_time('clean', time.perf_counter() - start)
+    if i:
+        yield finalize_intervention(i, filename, corpus_lang, language_index)
+    if language_index:
+        language_index.forget(filename)
+
+
+def parse_mapped_interventions(data, corpus_lang, filename, language_index=None):
+    """ As parse_interventions, but over the bytes of a whole session (see
+        Corpus.map_session). Only the lines that can start or end a speech
+        are found and decoded; each intervention holds the offsets of its
+        speech until it is finalized, when just that slice is decoded.
+    """
+    i = None
+    body_start = None
+    for match in boundary_line_regex.finditer(data):
+        line_start = match.start()
+        line_end = data.find(b'\n', line_start)
+        line_end = len(data) if line_end == -1 else line_end + 1
+        line = data[line_start:line_end]
+        if line.startswith(section_end_prefixes_bytes):
+            if i and body_start is not None:
+                add_mapped_data(i, data, body_start, line_start)
+            body_start = None
+            continue
+        if line.startswith(applause_prefixes_bytes) or b'SPEAKER' not in line:
+            continue
+        if i:
+            if body_start is not None:
+                add_mapped_data(i, data, body_start, line_start)
+            yield finalize_intervention(i, filename, corpus_lang, language_index)
+        line = line.decode('utf-8')
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        i = Intervention(line)
+        run_stats.check_input('parse', f'{corpus_lang}/{filename}', line, time.thread_time() - cpu_start)
+        run_stats.add_time('parse', time.perf_counter() - start)
+        body_start = line_end
+    if i:
+        if body_start is not None:
+            add_mapped_data(i, data, body_start, len(data))
+        yield finalize_intervention(i, filename, corpus_lang, language_index)
+    if language_index:
+        language_index.forget(filename)
+
+
+def add_mapped_data(i, data, start, end):
+    """ Adds the lines of data[start:end] to an intervention as
+        parse_interventions would, one line (with its newline) at a time
+    """
+    if start >= end:
+        return
+    clean_start = time.perf_counter()
+    lines = data[start:end].decode('utf-8').split('\n')
+    last = len(lines) - 1
+    for n, line in enumerate(lines):
+        if n < last:
+            line += '\n'
+        elif not line:
+            break
+        if not line.startswith(applause_prefixes):
+            i.add_data(line)
+    run_stats.add_time('clean', time.perf_counter() - clean_start)
+
+
+def parse_session(corpus, corpus_lang, filename, language_index=None):
+    """ Yields the finalized Interventions of a session file, from its bytes
+        where possible. Preprocessing rewrites whole lines, and text mode
+        also ends lines at a lone carriage return, so those are parsed line
+        by line.
+    """
+    if not corpus.preprocess:
+        # a mapping is unmapped as soon as nothing refers to it
+        data = corpus.map_session(corpus_lang, filename)
+        if data.find(b'\r') == -1:
+            yield from parse_mapped_interventions(data, corpus_lang, filename, language_index)
+            return
+    yield from parse_interventions(corpus.read_lines(corpus_lang, filename), corpus_lang, filename, language_index)
+
+
+def finalize_intervention(i, filename, corpus_lang, language_index=None):
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    i.finalize()
+    run_stats.check_input('clean', f'{corpus_lang}/{filename}', i.data, time.thread_time() - cpu_start)
+    resolve_start = time.perf_counter()
+    run_stats.add_time('clean', resolve_start - start)
+    if i.language == 'UNKNOWN' and language_index:
+        run_stats.count('language.lookups')
+        new_lang = language_index.lookup(filename, i.speech_id, exclude=corpus_lang)
+        if new_lang:
+            log.debug('Setting language to %s for SPEAKER ID=%s', new_lang, i.speech_id)
+            i.language = new_lang
+            run_stats.count('language.resolved')
+        else:
+            run_stats.count('language.unresolved')
+        run_stats.add_time('resolve', time.perf_counter() - resolve_start)
+    run_stats.count('interventions')
+    return i
+
+
+def iter_corpus(language, input_path='./txt', resolve_languages=True, preprocess=False):
+    """ Yields (filename, Intervention) for every session file of a language,
+        e.g. for filename, i in iter_corpus('EN'): ...
+        input_path is either the extracted txt directory or europarl.tgz
+    """
+    corpus = open_corpus(input_path, preprocess)
+    corpus_lang = language.lower()
+    language_index = LanguageIndex(corpus) if resolve_languages else None
+    for filename in corpus.list_files(corpus_lang):
+        if len(filename) != 15:
+            continue
+        for i in parse_session(corpus, corpus_lang, filename, language_index):
+            yield filename, i
+
+
+def get_output_path(corpus_lang, filename, compress=False):
+    output_filename = os.path.join(f'./xml/{corpus_lang}', get_output_filename(corpus_lang, filename))
+    if compress:
+        output_filename += '.gz'
+    return output_filename
+
+
+def escape(s):
+    """ As xml.sax.saxutils.escape, which takes a while to import """
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_attribute(s):
+    return escape(str(s)).replace('"', '&quot;')
+
+
+class EcpcWriter():
+    """ Writes an ecpc_EP document one intervention at a time, so that
+        interventions are written as soon as they are finalized.
+        Each intervention is built as one string and written to a buffered
+        (optionally gzip compressed) temporary file, which replaces the
+        output file once the document is complete.
+    """
+
+    def __init__(self, output_filename, document_filename, language, compress=False):
+        self.output_filename = output_filename
+        self.document_filename = document_filename
+        self.language = language
+        self.compress = compress
+        self.tmp_filename = f'{output_filename}.tmp'
+        self.ofile = None
+
+    def __enter__(self):
+        if self.compress:
+            import gzip
+            self.ofile = gzip.open(self.tmp_filename, 'wt', encoding='utf-8')
+        else:
+            self.ofile = open(self.tmp_filename, 'w', encoding='utf-8', buffering=1 << 16)
+        self.ofile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<!DOCTYPE ecpc_EP SYSTEM "ep.dtd">\n'
+                         '<ecpc_EP>\n'
+                         f'  <header filename="{escape_attribute(self.document_filename)}" '
+                         f'language="{escape_attribute(self.language)}"/>\n'
+                         '  <body>\n')
+        return self
+
+    def write_intervention(self, i):
+        parts = ['    <intervention>\n']
+        for speaker in i.speakers:
+            parts.append('      <speaker>\n'
+                         f'        <name>{escape(speaker.name)}</name>\n'
+                         f'        <affiliation EPparty="{escape_attribute(speaker.affiliation)}"/>\n'
+                         '        <post/>\n'
+                         '      </speaker>\n')
+        parts.append(f'      <speech ref="s{escape_attribute(i.speech_id)}" language="{escape_attribute(i.language)}">'
+                     f'{escape(i.data.strip())}</speech>\n'
+                     '    </intervention>\n')
+        self.ofile.write(''.join(parts))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.ofile.close()
+            os.remove(self.tmp_filename)
+            return
+        self.ofile.write('  </body>\n'
+                         '<back/>\n'
+                         '</ecpc_EP>\n')
+        self.ofile.close()
+        os.replace(self.tmp_filename, self.output_filename)
+
+
+class DtdValidator():
+    """ Validates documents against the element content models and attribute
+        lists of a DTD, with the same pass/fail result as
+        xmllint --noout --valid but without a process and a reparse per file.
+        Only the declarations that ep.dtd uses are supported: EMPTY, ANY,
+        mixed and element content models, and CDATA, ID and enumerated
+        attributes.
+        The converter's output departs from ep.dtd in two known ways: affiliations
+        keep EPparty values that are not in the DTD (europarl-parser.sh strips
+        them with sed), and an intervention can have several speakers. These
+        are errors, unless lenient, when they are reported as known deviations.
+    """
+
+    lenient_attributes = {('affiliation', 'EPparty')}
+    repeatable_children = {'intervention': {'speaker', 'writer'}}
+
+    declaration_regex = re.compile(r'<!(ELEMENT|ATTLIST)\s+(\S+)\s+(.*?)>', re.DOTALL)
+    comment_regex = re.compile(r'<!--.*?-->', re.DOTALL)
+    model_token_regex = re.compile(r'#PCDATA|[\w.:-]+|[(),|*+?]')
+    attribute_token_regex = re.compile(r'\([^)]*\)|"[^"]*"|\'[^\']*\'|\S+')
+    name_regex = re.compile(r'[^\W\d][\w.:-]*|[_:][\w.:-]*')
+
+    def __init__(self, dtd_filename, root='ecpc_EP', lenient=False):
+        self.dtd_filename = dtd_filename
+        self.root = root
+        self.lenient = lenient
+        self.elements = {}
+        self.attributes = {}
+        with open(dtd_filename, encoding='utf-8') as f:
+            dtd = self.comment_regex.sub('', f.read())
+        for kind, name, body in self.declaration_regex.findall(dtd):
+            if kind == 'ELEMENT':
+                self.elements[name] = self.compile_model(body.strip())
+            else:
+                self.attributes.setdefault(name, {}).update(self.parse_attributes(body))
+
+    def compile_model(self, model):
+        """ Returns (kind, allowed): the set of allowed child elements for
+            mixed content, or a regex matching the sequence of child
+            element names for element content
+        """
+        if model == 'EMPTY':
+            return 'empty', None
+        if model == 'ANY':
+            return 'any', None
+        tokens = self.model_token_regex.findall(model)
+        if '#PCDATA' in tokens:
+            return 'mixed', {t for t in tokens if t not in '#PCDATA(),|*+?'}
+        pattern = []
+        for t in tokens:
+            if t == '(':
+                pattern.append('(?:')
+            elif t == ',':
+                continue
+            elif t in ')|*+?':
+                pattern.append(t)
+            else:
+                pattern.append(f'(?:{re.escape(t)} )')
+        return 'children', re.compile(''.join(pattern))
+
+    def parse_attributes(self, body):
+        """ Returns {attribute: (allowed values or type, default)} """
+        attributes = {}
+        tokens = self.attribute_token_regex.findall(body)
+        while len(tokens) >= 3:
+            name, attribute_type, default = tokens[:3]
+            tokens = tokens[3:]
+            if default == '#FIXED':
+                default = tokens.pop(0)
+            if attribute_type.startswith('('):
+                attribute_type = {v.strip() for v in attribute_type.strip('()').split('|')}
+            attributes[name] = (attribute_type, default)
+        return attributes
+
+    def validate(self, filename):
+        """ Returns (errors, deviations), the lists of validity errors and of
+            known deviations, both empty if the document is valid
+        """
+        import gzip
+        from xml.etree import ElementTree
+        errors = []
+        deviations = []
+        ids = set()
+        opener = gzip.open if filename.endswith('.gz') else open
+        try:
+            with opener(filename, 'rb') as f:
+                root = None
+                for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+                    if event == 'start':
+                        if root is None:
+                            root = elem
+                            if elem.tag != self.root:
+                                errors.append(f'root element {elem.tag} does not match {self.root}')
                         continue
-                    base_path = input_path.replace(f'{corpus_lang}', la)
-                    input_filename = os.path.join(base_path, filename)
-                    try:
-                        with open(input_filename) as ifile:
-                            print(f'Opening {input_filename} for unknown lang for SPEAKER ID={i.speech_id}')
-                            for line in ifile:
-                                regex = f'SPEAKER ID="?{i.speech_id}"? .*LANGUAGE="([A-Z][A-Z])"'
-                                match = re.search(regex, line)
-                                if match:
-                                    new_lang = match.group(1)
-                                    if new_lang in valid_langs:
-                                        print(f'Setting language to {new_lang}')
-                                        i.language = new_lang
-                                        break
-                                    else:
-                                        print(f'bad new_lang: {new_lang}')
-                    except FileNotFoundError:
-                        print(f'{input_filename} does not exist')
-
-        output_parts = filename.replace('.txt', '.xml').replace('ep-', '').split('-')
-        if int(output_parts[0]) < 50:
-            century = '20'
+                    self.validate_element(elem, ids, errors, deviations)
+                    # children have been checked, only the parent needs them
+                    del elem[:]
+        except ElementTree.ParseError as e:
+            errors.append(f'not well-formed: {e}')
+        return errors, deviations
+
+    def validate_element(self, elem, ids, errors, deviations):
+        tag = elem.tag
+        if tag not in self.elements:
+            errors.append(f'no declaration for element {tag}')
+            return
+        declared = self.attributes.get(tag, {})
+        for name, value in elem.attrib.items():
+            if name not in declared:
+                errors.append(f'no declaration for attribute {name} of element {tag}')
+                continue
+            attribute_type = declared[name][0]
+            if isinstance(attribute_type, set):
+                if value not in attribute_type:
+                    found = deviations if self.lenient and (tag, name) in self.lenient_attributes else errors
+                    found.append(f'value "{value}" for attribute {name} of {tag} is not among the enumerated set')
+            elif attribute_type == 'ID':
+                if not self.name_regex.fullmatch(value):
+                    errors.append(f'value "{value}" for attribute {name} of {tag} is not a valid ID')
+                elif value in ids:
+                    errors.append(f'ID {value} already defined')
+                ids.add(value)
+        for name, (attribute_type, default) in declared.items():
+            if default == '#REQUIRED' and name not in elem.attrib:
+                errors.append(f'element {tag} does not carry attribute {name}')
+        kind, allowed = self.elements[tag]
+        if kind == 'any':
+            return
+        children = [child.tag for child in elem]
+        has_text = any(t and t.strip(' \t\r\n') for t in [elem.text] + [child.tail for child in elem])
+        if kind == 'empty':
+            if children or elem.text:
+                errors.append(f'element {tag} was declared EMPTY this one has content')
+        elif kind == 'mixed':
+            for child in children:
+                if child not in allowed:
+                    errors.append(f'element {child} is not allowed in {tag}')
         else:
-            century = '19'
-        o = corpus_lang.upper() + century + ''.join(output_parts)
-        output_filename = os.fsdecode(os.path.join(output_path, o))
-        with open(output_filename, 'w') as ofile:
-            print(f'Writing {output_filename}')
-            ofile.write(f' <?xml version="1.0" encoding="UTF-8"?>\n')
-            ofile.write(f'<ecpc_EP>\n')
-            ofile.write(f'  <header filename="{o.replace(".xml", ".xml")}" language="{corpus_lang.upper()}"/>\n')
-            ofile.write(f'  <body>\n')
+            if has_text:
+                errors.append(f'element {tag} has character data, but only elements are allowed')
+            if not allowed.fullmatch(''.join(f'{child} ' for child in children)):
+                repeatable = self.repeatable_children.get(tag, ())
+                single = [child for n, child in enumerate(children)
+                          if not (n and child == children[n - 1] and child in repeatable)]
+                lenient = self.lenient and allowed.fullmatch(''.join(f'{child} ' for child in single))
+                found = deviations if lenient else errors
+                found.append(f'element {tag} content does not follow the DTD, got ({" ".join(children)})')
+
+
+def has_datasets(formats):
+    return any(f in CorpusDataset.formats for f in formats)
+
+
+def get_intervention_row(date, filename, i):
+    return {'date': date, 'filename': filename, 'speech_id': i.speech_id, 'language': i.language,
+            'speakers': [s.name for s in i.speakers], 'affiliations': [s.affiliation for s in i.speakers],
+            'text': i.data.strip()}
+
+
+class CorpusDataset():
+    """ Writes each language corpus as a single dataset with one row per
+        intervention, as JSON Lines (xml/EN.jsonl) and/or SQLite
+        (xml/EN.sqlite). In SQLite the speakers of each intervention are a
+        separate table, and language, affiliation and speaker name are
+        indexed, e.g. for all S&D speeches originally in German:
+
+        SELECT i.* FROM interventions i JOIN speakers s ON s.intervention_id = i.id
+        WHERE s.affiliation = 'S&D' AND i.language = 'DE'
+
+        Datasets are built in temporary files which replace the previous
+        datasets when all the files of the run have been converted.
+    """
+
+    formats = ['jsonl', 'sqlite']
+    schema = ['CREATE TABLE interventions (id INTEGER PRIMARY KEY, date TEXT, filename TEXT, speech_id TEXT, '
+              'language TEXT, text TEXT)',
+              'CREATE TABLE speakers (intervention_id INTEGER REFERENCES interventions(id), name TEXT, '
+              'affiliation TEXT)']
+    indexes = ['CREATE INDEX interventions_language ON interventions (language)',
+               'CREATE INDEX interventions_date ON interventions (date)',
+               'CREATE INDEX speakers_affiliation ON speakers (affiliation)',
+               'CREATE INDEX speakers_name ON speakers (name)',
+               'CREATE INDEX speakers_intervention ON speakers (intervention_id)']
+
+    def __init__(self, formats, output_dir='./xml'):
+        self.formats = [f for f in formats if f in CorpusDataset.formats]
+        self.output_dir = output_dir
+        self.jsonl_files = {}
+        self.databases = {}
+        self.tmp_filenames = {}
+
+    def get_path(self, corpus_lang, dataset_format):
+        return os.path.join(self.output_dir, f'{corpus_lang.upper()}.{dataset_format}')
+
+    def get_tmp_path(self, corpus_lang, dataset_format):
+        path = self.get_path(corpus_lang, dataset_format)
+        tmp_filename = f'{path}.tmp'
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        self.tmp_filenames[tmp_filename] = path
+        return tmp_filename
+
+    def get_jsonl_file(self, corpus_lang):
+        if corpus_lang not in self.jsonl_files:
+            tmp_filename = self.get_tmp_path(corpus_lang, 'jsonl')
+            self.jsonl_files[corpus_lang] = open(tmp_filename, 'w', encoding='utf-8', buffering=1 << 16)
+        return self.jsonl_files[corpus_lang]
+
+    def get_database(self, corpus_lang):
+        if corpus_lang not in self.databases:
+            import sqlite3
+            db = sqlite3.connect(self.get_tmp_path(corpus_lang, 'sqlite'))
+            # a temporary file that is discarded on failure does not need a journal
+            db.execute('PRAGMA journal_mode = OFF')
+            db.execute('PRAGMA synchronous = OFF')
+            for statement in self.schema:
+                db.execute(statement)
+            self.databases[corpus_lang] = db
+        return self.databases[corpus_lang]
+
+    def write(self, corpus_lang, rows):
+        if 'jsonl' in self.formats:
+            ofile = self.get_jsonl_file(corpus_lang)
+            ofile.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+        if 'sqlite' in self.formats:
+            db = self.get_database(corpus_lang)
+            with db:
+                for row in rows:
+                    cursor = db.execute('INSERT INTO interventions (date, filename, speech_id, language, text) '
+                                        'VALUES (?, ?, ?, ?, ?)',
+                                        (row['date'], row['filename'], row['speech_id'], row['language'],
+                                         row['text']))
+                    db.executemany('INSERT INTO speakers (intervention_id, name, affiliation) VALUES (?, ?, ?)',
+                                   [(cursor.lastrowid, name, affiliation)
+                                    for name, affiliation in zip(row['speakers'], row['affiliations'])])
+
+    def close(self):
+        for ofile in self.jsonl_files.values():
+            ofile.close()
+        for db in self.databases.values():
+            # indexes are created once the data is loaded, which is faster than maintaining them
+            with db:
+                for statement in self.indexes:
+                    db.execute(statement)
+            db.close()
+        for tmp_filename, path in self.tmp_filenames.items():
+            os.replace(tmp_filename, path)
+            log.info('Wrote %s', path)
+
+    def discard(self):
+        for ofile in self.jsonl_files.values():
+            ofile.close()
+        for db in self.databases.values():
+            db.close()
+        for tmp_filename in self.tmp_filenames:
+            os.remove(tmp_filename)
+
+
+def convert_file(corpus, corpus_lang, filename, language_index, compress=False, validator=None,
+                 write_xml=True, rows=None):
+    """ Returns the output filename (None if no xml was written), the inputs
+        (as lang/filename) that were used and whether the output is valid
+        (None if it was not validated). If rows is a list, a dataset row is
+        appended to it for each intervention.
+    """
+    log.info('Processing %s', corpus.get_name(corpus_lang, filename))
+    convert_start = time.perf_counter()
+    interventions = parse_session(corpus, corpus_lang, filename, language_index)
+    if rows is not None:
+        date = get_session_date(filename)
+        interventions = collect_rows(interventions, date, filename, rows)
+    output_filename = None
+    valid = None
+    if write_xml:
+        output_filename = get_output_path(corpus_lang, filename, compress)
+        document_filename = get_output_filename(corpus_lang, filename)
+        with EcpcWriter(output_filename, document_filename, corpus_lang.upper(), compress) as writer:
             for i in interventions:
-                ofile.write(f'    <intervention>\n')
-                for speaker in i.speakers:
-                    ofile.write(f'      <speaker>\n')
-                    ofile.write(f'        <name>{speaker.name}</name>\n')
-                    ofile.write(f'        <affiliation EPparty="{speaker.affiliation}"/>\n')
-                    ofile.write(f'        <post/>\n')
-                    ofile.write(f'      </speaker>\n')
-                ofile.write(f'      <speech ref="s{i.speech_id}" language="{i.language}">{i.data.strip()}</speech>\n')
-                ofile.write(f'    </intervention>\n')
-            ofile.write('  </body>\n')
-            ofile.write('<back/>\n')
-            ofile.write('</ecpc_EP>\n')
-#    for speaker in all_speakers:
-#        print(f'all_speakers:{speaker}')
+                start = time.perf_counter()
+                writer.write_intervention(i)
+                run_stats.add_time('write', time.perf_counter() - start)
+        log.info('Wrote %s', output_filename)
+    else:
+        # only the dataset rows are wanted
+        for i in interventions:
+            pass
+    run_stats.add_time('convert', time.perf_counter() - convert_start)
+    if validator:
+        start = time.perf_counter()
+        valid = validate_file(validator, output_filename)
+        run_stats.add_time('validate', time.perf_counter() - start)
+    run_stats.count('files')
+    run_stats.count('bytes', (corpus.stat(corpus_lang, filename) or [0])[0])
+    input_keys = [f'{corpus_lang}/{filename}'] + language_index.take_consulted(filename)
+    return output_filename, input_keys, valid
 
 
-def main():
-    process()
+def collect_rows(interventions, date, filename, rows):
+    for i in interventions:
+        rows.append(get_intervention_row(date, filename, i))
+        yield i
+
+
+def validate_file(validator, filename):
+    errors, deviations = validator.validate(filename)
+    if deviations:
+        run_stats.count('validation.known_deviations')
+        for deviation in deviations:
+            log.debug('%s: %s', filename, deviation)
+    if not errors:
+        if deviations:
+            log.info('%s is valid apart from %s known deviations from the DTD', filename, len(deviations))
+        else:
+            log.info('%s is valid', filename)
+        return True
+    log.warning('%s is not valid: %s', filename, errors[0])
+    for error in errors[1:]:
+        log.debug('%s: %s', filename, error)
+    return False
+
+
+def get_signatures(corpus, input_keys):
+    return {key: corpus.signature(*key.split('/')) for key in input_keys}
+
+
+def setup_logging(level=logging.INFO, debug_categories=()):
+    """ Diagnostics are logged lazily, so nothing is formatted for levels or
+        categories that are not enabled
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.handlers = [handler]
+    log.propagate = False
+    log.setLevel(level)
+    for category in log_categories:
+        if category in debug_categories or 'all' in debug_categories:
+            logging.getLogger(f'europarl.{category}').setLevel(logging.DEBUG)
+        else:
+            logging.getLogger(f'europarl.{category}').setLevel(logging.NOTSET)
+
+
+def get_log_level(args):
+    if args.quiet:
+        return logging.WARNING
+    if args.verbose:
+        return logging.DEBUG
+    return logging.INFO
+
+
+worker_corpus = None
+worker_language_index = None
+worker_record_inputs = False
+worker_compress = False
+worker_validator = None
+worker_formats = ['xml']
+worker_profile = None
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--file', help='File to operate on')
-parser.add_argument('--language', choices=valid_langs, default='EN', help='Source language')
-args = parser.parse_args()
+def init_worker(corpus, index_filename, prefetched=None, log_level=logging.INFO, debug_categories=(),
+                record_inputs=False, compress=False, validator=None, formats=('xml',), profile=None):
+    global worker_corpus, worker_language_index, worker_record_inputs, worker_compress, worker_validator
+    global worker_formats, worker_profile
+    setup_logging(log_level, debug_categories)
+    speaker_registry.track_new = True
+    worker_corpus = corpus
+    worker_language_index = LanguageIndex(corpus, index_filename, keep=bool(prefetched))
+    if prefetched:
+        worker_language_index.files.update(prefetched)
+        worker_language_index.checked.update(prefetched)
+    worker_record_inputs = record_inputs
+    worker_compress = compress
+    worker_validator = validator
+    worker_formats = formats
+    worker_profile = profile
+    if profile:
+        run_stats.profile_top = profile
+
+
+def convert_worker(task):
+    """ Runs in a pool process, returns (task, result, error, new language
+        index entries, speaker counts, run stats) so that one bad file does
+        not abort the whole run. The input signatures for the manifest are
+        computed here too.
+    """
+    corpus_lang, filename = task
+    rows = [] if has_datasets(worker_formats) else None
+    convert = functools.partial(profile_call, '/'.join(task), convert_file) if worker_profile else convert_file
+    try:
+        output_filename, input_keys, valid = convert(worker_corpus, corpus_lang, filename, worker_language_index,
+                                                     worker_compress, worker_validator, 'xml' in worker_formats, rows)
+        inputs = get_signatures(worker_corpus, input_keys) if worker_record_inputs else None
+        result = (output_filename, inputs, valid, rows)
+        error = None
+    except Exception as e:
+        result = None
+        error = f'{type(e).__name__}: {e}'
+    return task, result, error, worker_language_index.take_new(), speaker_registry.take_new(), run_stats.take()
+
+
+def get_files(args):
+    """ The session files given with --file and --files-from, in order and
+        without duplicates. A fragment such as ep-07-01-15-001.txt stands for
+        its whole session, ep-07-01-15.txt.
+    """
+    files = list(args.file)
+    if args.files_from:
+        if args.files_from == '-':
+            files.extend(sys.stdin.read().split())
+        else:
+            with open(args.files_from) as ifile:
+                files.extend(ifile.read().split())
+    sessions = []
+    for f in files:
+        f = os.path.basename(f)
+        match = session_file_regex.match(f)
+        sessions.append(f'{match.group(1)}.txt' if match else f)
+    return list(dict.fromkeys(sessions))
+
+
+def get_tasks(args, corpus):
+    if args.all_languages:
+        langs = [lang.lower() for lang in valid_langs]
+    else:
+        langs = [args.language.lower()]
+    given_files = get_files(args)
+    tasks = []
+    for corpus_lang in langs:
+        if given_files:
+            files = given_files
+        else:
+            files = corpus.list_files(corpus_lang)
+        for f in files:
+            if len(f) != 15:
+                log.warning('%s not correct length: %s', f, len(f))
+                continue
+            tasks.append((corpus_lang, f))
+        output_dir = f'./xml/{corpus_lang}'
+        os.makedirs(output_dir, exist_ok=True)
+        # the output refers to ep.dtd, so it is kept alongside as europarl-parser.sh does
+        if os.path.isfile(args.dtd) and not os.path.exists(os.path.join(output_dir, 'ep.dtd')):
+            import shutil
+            shutil.copy(args.dtd, os.path.join(output_dir, 'ep.dtd'))
+    if len(langs) > 1:
+        # the languages of a session one after the other, while the index of its other language files is at hand
+        tasks.sort(key=lambda task: (task[1], task[0]))
+    return tasks
+
+
+def get_output_options(args):
+    """ The options that change the converted output """
+    options = []
+    if args.preprocess:
+        options.append('preprocess')
+    return options
+
+
+def build_alignment_index(args):
+    alignment_index = AlignmentIndex(open_corpus(args.input), args.alignment_index)
+    try:
+        alignment_index.build()
+    finally:
+        alignment_index.close()
+    log.info('Wrote alignment index %s', args.alignment_index)
+    return True
+
+
+def convert_task(args, corpus, task, language_index, validator=None, formats=('xml',), rows=None,
+                 record_inputs=False):
+    """ Converts a (lang, filename) task in this process, returning (result, error) as convert_worker does """
+    convert = convert_file
+    if args.profile:
+        convert = functools.partial(profile_call, '/'.join(task), convert_file)
+    try:
+        output_filename, input_keys, valid = convert(corpus, *task, language_index, args.gzip,
+                                                     validator, 'xml' in formats, rows)
+        inputs = get_signatures(corpus, input_keys) if record_inputs else None
+        return (output_filename, inputs, valid, rows), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def process(args):
+    start = time.perf_counter()
+    if args.profile:
+        run_stats.profile_top = args.profile
+    corpus = open_corpus(args.input, args.preprocess)
+    tasks = get_tasks(args, corpus)
+    if corpus.compressed:
+        if args.jobs > 1 or args.file or args.files_from:
+            log.warning('%s is compressed, so each of --jobs decompresses it and --file still reads through it; '
+                        'decompress it once with gunzip -k for random access', args.input)
+        # seeking backwards in a compressed archive means decompressing it again from the start
+        order = {key: n for n, key in enumerate(corpus.order_keys('/'.join(task) for task in tasks))}
+        tasks.sort(key=lambda task: order.get('/'.join(task), -1))
+    # an archive is converted in archive order, a language at a time, so what is prefetched is kept
+    language_index = LanguageIndex(corpus, args.language_index, keep=corpus.compressed)
+    manifest = Manifest(args.manifest, get_output_options(args)) if args.manifest else None
+    formats = args.format or ['xml']
+    dataset = CorpusDataset(formats) if has_datasets(formats) else None
+    validator = DtdValidator(args.dtd, lenient=args.lenient) if args.validate and 'xml' in formats else None
+    failures = []
+    invalid = []
+    converted = 0
+
+    if dataset and manifest and not args.force:
+        log.info('Datasets are written in full, so all files are converted')
+    elif manifest and not args.force:
+        all_tasks = tasks
+        tasks = [task for task in all_tasks if not manifest.is_up_to_date(get_output_path(*task, args.gzip), corpus)]
+        log.info('Skipping %s/%s up to date files', len(all_tasks) - len(tasks), len(all_tasks))
+
+    def completed(task, result, error):
+        nonlocal converted
+        if error:
+            failures.append((task, error))
+            log.error('Error converting %s: %s', '/'.join(task), error)
+            return
+        converted += 1
+        output_filename, inputs, valid, rows = result
+        if valid is False:
+            invalid.append(output_filename)
+        if dataset:
+            start = time.perf_counter()
+            dataset.write(task[0], rows)
+            run_stats.add_time('dataset', time.perf_counter() - start)
+        if manifest and output_filename:
+            manifest.record(output_filename, inputs)
+            manifest.checkpoint()
+
+    try:
+        language_index.prefetch(tasks)
+        if args.jobs > 1:
+            prefetched = language_index.files if corpus.compressed else None
+            initargs = (corpus, args.language_index, prefetched, get_log_level(args), args.debug, bool(manifest),
+                        args.gzip, validator, formats, args.profile)
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                                     initargs=initargs) as executor:
+                # with all languages, a chunk is about a session in each of them
+                chunksize = len(valid_langs) if args.all_languages else 4
+                results = executor.map(convert_worker, tasks, chunksize=chunksize)
+                for task, result, error, new_entries, speaker_counts, stats in results:
+                    language_index.update(new_entries)
+                    speaker_registry.update(speaker_counts)
+                    run_stats.update(stats)
+                    completed(task, result, error)
+        else:
+            for task in tasks:
+                rows = [] if dataset else None
+                completed(task, *convert_task(args, corpus, task, language_index, validator, formats, rows,
+                                              bool(manifest)))
+    except BaseException:
+        if dataset:
+            dataset.discard()
+        raise
+    finally:
+        # saved even if interrupted, so that a rerun resumes where this one stopped
+        if manifest:
+            manifest.save()
+        language_index.save()
+
+    if dataset:
+        if failures:
+            # a dataset missing the files that failed would replace a complete one
+            dataset.discard()
+            log.error('Not writing the datasets, as %s files failed', len(failures))
+        else:
+            dataset.close()
+    if args.speakers:
+        speaker_registry.export(args.speakers)
+    log.info('Converted %s/%s files', converted, len(tasks))
+    elapsed = time.perf_counter() - start
+    run_stats.log_summary(elapsed)
+    if args.stats:
+        run_stats.save(args.stats, elapsed)
+    if validator:
+        log.info('Valid %s/%s files', converted - len(invalid), converted)
+        if run_stats.counters['validation.known_deviations']:
+            log.info('%s files have EPparty values outside ep.dtd or interventions with several speakers',
+                     run_stats.counters['validation.known_deviations'])
+        for output_filename in invalid:
+            log.warning('Not valid: %s', output_filename)
+    for task, error in failures:
+        log.error('Failed: %s: %s', '/'.join(task), error)
+    return not failures and not invalid
+
+
+class DirectoryWatcher():
+    """ Waits between the polls of --watch. With the optional inotify_simple
+        package a poll starts as soon as a file is written or moved into one of
+        the language directories, otherwise they are polled every interval seconds.
+    """
+
+    def __init__(self, base_path, langs, interval):
+        self.base_path = base_path
+        self.langs = langs
+        self.interval = interval
+        self.watched = set()
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            self.inotify = None
+            log.debug('inotify_simple is not installed, polling every %ss', interval)
+            return
+        self.inotify = INotify()
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+        self.add_watches()
+
+    def add_watches(self):
+        """ Watch the language directories, including those created since the last poll """
+        for path in [self.base_path] + [os.path.join(self.base_path, lang) for lang in self.langs]:
+            if path not in self.watched and os.path.isdir(path):
+                self.inotify.add_watch(path, self.mask)
+                self.watched.add(path)
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            timeout = self.interval
+        if not self.inotify:
+            time.sleep(timeout)
+            return
+        self.add_watches()
+        if self.inotify.read(timeout=int(timeout * 1000)):
+            # let a burst of writes, e.g. an unpacked archive, finish first
+            while self.inotify.read(timeout=200):
+                pass
+
+
+def watch(args):
+    """ Converts new and changed session files as they appear, until interrupted.
+        The corpus, the language index, the manifest and the name caches stay
+        in memory between polls, so that a new file is converted within seconds.
+    """
+    start = time.perf_counter()
+    if args.profile:
+        run_stats.profile_top = args.profile
+    corpus = open_corpus(args.input, args.preprocess)
+    # files can be rewritten in place while they are converted, e.g. by tar x
+    corpus.use_mmap = False
+    language_index = LanguageIndex(corpus, args.language_index, keep=True)
+    # without --manifest, everything is converted once and then only what changes
+    manifest = Manifest(args.manifest, get_output_options(args))
+    validator = DtdValidator(args.dtd, lenient=args.lenient) if args.validate else None
+    langs = [lang.lower() for lang in valid_langs] if args.all_languages else [args.language.lower()]
+    watcher = DirectoryWatcher(args.input, langs, args.watch)
+    if args.jobs > 1:
+        log.info('--watch converts in a single process, ignoring --jobs')
+    log.info('Watching %s for new session files', args.input)
+    failed = {}
+    force = args.force
+    try:
+        while True:
+            corpus.refresh()
+            language_index.refresh()
+            tasks = []
+            settling = False
+            now = time.time_ns()
+            for task in get_tasks(args, corpus):
+                stat = corpus.stat(*task)
+                if not stat or not force and manifest.is_up_to_date(get_output_path(*task, args.gzip), corpus):
+                    continue
+                if failed.get(task) == stat:
+                    continue
+                # a file modified this recently may still be being written
+                if now - stat[1] < watch_settle_seconds * 1e9:
+                    settling = True
+                    continue
+                tasks.append(task)
+            for task in tasks:
+                result, error = convert_task(args, corpus, task, language_index, validator, record_inputs=True)
+                if error:
+                    # not retried until the file changes
+                    failed[task] = corpus.stat(*task)
+                    log.error('Error converting %s: %s', '/'.join(task), error)
+                    continue
+                failed.pop(task, None)
+                output_filename, inputs, valid, rows = result
+                manifest.record(output_filename, inputs)
+                if valid is False:
+                    log.warning('Not valid: %s', output_filename)
+            if tasks:
+                manifest.save()
+                language_index.save()
+            force = False
+            watcher.wait(watch_settle_seconds if settling else None)
+    except KeyboardInterrupt:
+        log.info('Stopped watching')
+    finally:
+        manifest.save()
+        language_index.save()
+    if args.speakers:
+        speaker_registry.export(args.speakers)
+    elapsed = time.perf_counter() - start
+    run_stats.log_summary(elapsed)
+    if args.stats:
+        run_stats.save(args.stats, elapsed)
+    return True
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default='./txt',
+                        help='Extracted txt directory, or europarl.tgz to read without extracting it')
+    parser.add_argument('--file', nargs='+', action='extend', default=[],
+                        help='Files to operate on, can be given more than once')
+    parser.add_argument('--files-from', help='File listing the files to operate on, one per line, or - for stdin')
+    parser.add_argument('--preprocess', action='store_true',
+                        help='Fix SPEAKER headers as europarl-parser.sh does before converting')
+    parser.add_argument('--language', choices=valid_langs, default='EN', help='Source language')
+    parser.add_argument('--all-languages', action='store_true', help='Convert all languages')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of files to convert in parallel')
+    parser.add_argument('--language-index', help='json file in which to persist the SPEAKER ID -> LANGUAGE index')
+    parser.add_argument('--alignment-index',
+                        help='Build or update this sqlite index of the byte offsets of each speech in every '
+                             'language, instead of converting')
+    parser.add_argument('--gzip', action='store_true', help='Write gzip compressed xml files')
+    parser.add_argument('--format', action='append', choices=['xml'] + CorpusDataset.formats,
+                        help='Output format, can be given more than once (default xml). jsonl and sqlite write '
+                             'one dataset per language with a row per intervention, e.g. xml/EN.sqlite')
+    parser.add_argument('--validate', action='store_true', help='Validate the xml files against the DTD')
+    parser.add_argument('--lenient', action='store_true',
+                        help='With --validate, count EPparty values outside the DTD and interventions with several '
+                             'speakers as known deviations rather than errors')
+    parser.add_argument('--dtd', default=default_dtd, help='DTD to validate against and copy alongside the xml files')
+    parser.add_argument('--profile', type=int, nargs='?', const=10,
+                        help='Profile each file and report the N (default 10) slowest with their top functions')
+    parser.add_argument('--stats', help='json file to write the run stats (stage timings and counters) to')
+    parser.add_argument('--speakers', help='csv file to write the table of all speakers to')
+    parser.add_argument('--manifest', help='json manifest of converted files, only changed files are converted again')
+    parser.add_argument('--watch', type=float, nargs='?', const=5, metavar='SECONDS',
+                        help='Keep running and convert new or changed session files, polling the input directory '
+                             'every SECONDS (default 5)')
+    parser.add_argument('--force', action='store_true', help='Convert all files even if the manifest says they are up to date')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log all diagnostics')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only log warnings and errors')
+    parser.add_argument('--debug', action='append', default=[], choices=log_categories + ['all'],
+                        help='Log diagnostics for a category, can be given more than once')
+    args = parser.parse_args()
+    if args.validate and not os.path.isfile(args.dtd):
+        parser.error(f'--validate needs a DTD, {args.dtd} does not exist (see --dtd)')
+    if has_datasets(args.format or ['xml']) and (args.file or args.files_from):
+        parser.error('--format jsonl and sqlite write a whole language at a time, not with --file or --files-from')
+    if args.watch is not None:
+        if os.path.isfile(args.input):
+            parser.error('--watch needs an extracted txt directory as --input')
+        if args.alignment_index or has_datasets(args.format or ['xml']):
+            parser.error('--watch only writes xml files')
+    setup_logging(get_log_level(args), args.debug)
+    if args.alignment_index:
+        ok = build_alignment_index(args)
+    elif args.watch is not None:
+        ok = watch(args)
+    else:
+        ok = process(args)
+    if not ok:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
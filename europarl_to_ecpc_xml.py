@@ -0,0 +1 @@
+europarl-to-ecpc-xml.py
\ No newline at end of file